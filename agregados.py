@@ -0,0 +1,84 @@
+import pandas as pd
+
+# Estatus homologados que se muestran como columnas en las tablas
+ESTATUS = ['Aprobada', 'Rechazada']
+
+# Columna por la que se ordena cada tabla según la opción "Ordenar por" del formulario
+COLUMNAS_ORDEN = {
+    'montos': {'Aprobada (#)': 'Aprobada (#)', 'Rechazada (#)': 'Rechazada (#)'},
+    'correos': {'Aprobada (#)': 'Aprobada (Correos Distintos)', 'Rechazada (#)': 'Rechazada (Correos Distintos)'},
+}
+
+
+def _por_estatus(serie, tipo):
+    # Pasar los estatus a columnas (Aprobada, Rechazada) rellenando con 0 los que falten
+    return serie.unstack('Estatus Homologado', fill_value=0).reindex(columns=ESTATUS, fill_value=0).astype(tipo)
+
+
+def resumen_montos(cubo, clave):
+    """Cantidad y monto por `clave` y estatus a partir de un corte del cubo diario.
+
+    Devuelve `(resultado, totales)`: `resultado` tiene la columna `clave` y las columnas
+    numéricas 'Aprobada (#)', 'Rechazada (#)', 'Aprobada ($)', 'Rechazada ($)',
+    'Total (#)' y 'Total ($)'; `totales` es un dict con la suma de cada una.
+    """
+    resumen = cubo.groupby([clave, 'Estatus Homologado'], observed=True)[['Cantidad', 'Suma_Monto']].sum()
+    cantidades = _por_estatus(resumen['Cantidad'], 'int64')
+    montos = _por_estatus(resumen['Suma_Monto'], 'float64')
+
+    resultado = pd.DataFrame({
+        clave: cantidades.index,
+        'Aprobada (#)': cantidades['Aprobada'].to_numpy(),
+        'Rechazada (#)': cantidades['Rechazada'].to_numpy(),
+        'Aprobada ($)': montos['Aprobada'].to_numpy(),
+        'Rechazada ($)': montos['Rechazada'].to_numpy(),
+    })
+    resultado['Total (#)'] = resultado['Aprobada (#)'] + resultado['Rechazada (#)']
+    resultado['Total ($)'] = resultado['Aprobada ($)'] + resultado['Rechazada ($)']
+
+    totales = {
+        'aprobada_n': int(resultado['Aprobada (#)'].sum()),
+        'aprobada_m': float(resultado['Aprobada ($)'].sum()),
+        'rechazada_n': int(resultado['Rechazada (#)'].sum()),
+        'rechazada_m': float(resultado['Rechazada ($)'].sum()),
+    }
+    totales['total_n'] = totales['aprobada_n'] + totales['rechazada_n']
+    totales['total_m'] = totales['aprobada_m'] + totales['rechazada_m']
+    return resultado, totales
+
+
+def correos_distintos(vinculos, fecha_inicio, fecha_final, estados_seleccionados):
+    """Correos distintos por 'Numero de cuenta' y estatus, contados con el índice de vínculos del dataset.
+
+    Devuelve `(resultado, totales)` con las columnas 'Aprobada (Correos Distintos)' y
+    'Rechazada (Correos Distintos)'; `totales['aproximado']` indica si se estimó con HyperLogLog.
+    """
+    cuentas, conteos, aproximado = vinculos.correos_distintos(fecha_inicio, fecha_final, estados_seleccionados)
+
+    resultado = pd.DataFrame({
+        'Numero de cuenta': cuentas,
+        'Aprobada (Correos Distintos)': conteos[:, 0].astype('int64'),
+        'Rechazada (Correos Distintos)': conteos[:, 1].astype('int64'),
+    })
+
+    totales = {
+        'aprobada': int(resultado['Aprobada (Correos Distintos)'].sum()),
+        'rechazada': int(resultado['Rechazada (Correos Distintos)'].sum()),
+        'aproximado': aproximado,
+    }
+    totales['total'] = totales['aprobada'] + totales['rechazada']
+    return resultado, totales
+
+
+def ordenar(resultado, ordenar_por, tipo='montos', limite=None):
+    """Ordena una tabla de mayor a menor según la opción "Ordenar por" (si no hay opción la deja igual).
+
+    Con `limite` solo se devuelven las primeras `limite` filas; si además hay que ordenar se
+    seleccionan con `nlargest` (selección parcial) en lugar de ordenar la tabla completa.
+    """
+    columna = COLUMNAS_ORDEN[tipo].get(ordenar_por)
+    if columna is None:
+        return resultado if limite is None else resultado.head(limite)
+    if limite is None:
+        return resultado.sort_values(by=columna, ascending=False)
+    return resultado.nlargest(limite, columna)
@@ -1,618 +1,605 @@
-from flask import Flask, render_template_string, request
-import pandas as pd
-import io
-import numpy as np
-from azure.storage.blob import BlobServiceClient
+from flask import Blueprint, Flask, Response, abort, current_app, g, jsonify, redirect, request, stream_with_context, url_for
+import atexit
 import datetime 
+import logging
 import os
+import threading
+import time
+from urllib.parse import urlencode
 
-# Crear la aplicación Flask
-app = Flask(__name__)
+from metricas import Perfilador, contar, iniciar_peticion, medir, metricas, registrar_cache, server_timing
+from respuestas import HuellaArchivos, cache_respuestas, codificar, elegir_codificacion, huella
 
+# pandas, pyarrow, openpyxl y el SDK de Azure no se importan aquí: los módulos que los usan
+# (datos, agregados, exportar, asincrono) se importan dentro de las funciones la primera vez que
+# hacen falta, así el proceso arranca y responde a /listo sin esperar a cargarlos
+
+logger = logging.getLogger(__name__)
+
+# Rutas de la aplicación; `crear_app` las registra en la aplicación Flask
+informe = Blueprint('informe', __name__)
+
+
+# Carpeta local con los .xlsx que sustituye al contenedor de Azure (desarrollo y benchmarks sin conexión)
+CONTENEDOR_LOCAL = os.getenv('CONTENEDOR_LOCAL')
+# Acceso a los blobs con el cliente asíncrono (azure.storage.blob.aio, requiere aiohttp): todas las
+# consultas y descargas del proceso se solapan en un único event loop en lugar de usar un hilo cada una
+BLOB_ASINCRONO = os.getenv('BLOB_ASINCRONO', '0') == '1'
 
 connect_str = os.getenv('AZURE_STORAGE_KEY_FLASK')
 container_name = "t1archivostablas"  # Nombre de tu contenedor
-blob_service_client = BlobServiceClient.from_connection_string(connect_str)
 
-@app.route('/', methods=['GET', 'POST'])
-def index():
-    
-    # Obtener la fecha actual para construir el nombre del archivo
-    fecha_actual = datetime.datetime.now().strftime('%m%Y')  # Formato: MMYYYY
-    T1_filename = f'T1_{fecha_actual}.xlsx'
-    claroscore_filename = f'Claroscore_{fecha_actual}.xlsx'
-    
-    # Descargar los archivos directamente desde Azure Blob Storage
-    blob_client = blob_service_client.get_container_client(container_name)
-    
-    # Leer los archivos en DataFrames
-    T1_blob = blob_client.download_blob(T1_filename).readall()
-    claroscore_blob = blob_client.download_blob(claroscore_filename).readall()
-    
-    
-    # Cargar los datos en DataFrames
-    T1 = pd.read_excel(io.BytesIO(T1_blob))
-    Claroscore = pd.read_excel(io.BytesIO(claroscore_blob))
-    
-    T1 = T1.rename(columns={'Estado de OperaciÃ³n': 'Estado de Operacion',
-                            'TerminaciÃ³n de la Tarjeta': 'Terminacion de la Tarjeta',
-                            })
-    
-    T1_fil = T1[['Fecha', 'Estado de Operacion', 'Email Cliente', 'Pedido', 'Terminacion de la Tarjeta', 'Monto',]]
-    
-    Claroscore_fil = Claroscore[[ 'ID de compra', 'Campo Personalizado 34' ]]
-    Claroscore_fil = Claroscore_fil.drop_duplicates()
-    
-    merged = pd.merge(T1_fil, Claroscore_fil[['ID de compra', 'Campo Personalizado 34']],
-                      how='left', left_on='Pedido', right_on='ID de compra')
-    
-    merged = merged.rename(columns={'Campo Personalizado 34': 'Numero de cuenta'})
-    merged = merged.drop(columns=['ID de compra'])
-    
-    merged = pd.merge(T1_fil, Claroscore_fil[['ID de compra', 'Campo Personalizado 34']], how='left', left_on='Pedido', right_on='ID de compra')
-    
-    merged = merged.rename(columns={'Campo Personalizado 34': 'Numero de cuenta'})
-    
-    merged = merged.drop(columns=['ID de compra'])
-    
-    merged['Estatus Homologado'] = np.where(
-        merged['Estado de Operacion'].isin(["Completada", "Cancelada", "Reembolso Parcial", "Reembolsada"]),
-        "Aprobada",
-        np.where(
-            merged['Estado de Operacion'].isin(["Rechazada por banco", "Rechazada por antifraude", "Fallida", "Pendiente"]),
-            "Rechazada",
-            "Revisar registro"
-        )
+# Opciones comunes del cliente de blobs (síncrono o asíncrono)
+BLOB_TIMEOUT_CONEXION = float(os.getenv('BLOB_TIMEOUT_CONEXION', '10'))
+BLOB_TIMEOUT_LECTURA = float(os.getenv('BLOB_TIMEOUT_LECTURA', '60'))
+BLOB_POOL_MAXIMO = int(os.getenv('BLOB_POOL_MAXIMO', '16'))
+opciones_blob = dict(
+    max_single_get_size=int(os.getenv('BLOB_TAMANO_DESCARGA_UNICA', str(8 * 1024 * 1024))),
+    max_chunk_get_size=int(os.getenv('BLOB_TAMANO_BLOQUE', str(4 * 1024 * 1024))),
+)
+opciones_reintentos = dict(initial_backoff=1, increment_base=2, retry_total=int(os.getenv('BLOB_REINTENTOS', '3')))
+
+# Cliente del contenedor: se crea la primera vez que se usa (ver `obtener_contenedor`)
+container_client = None
+_lock_contenedor = threading.Lock()
+_lock_app = threading.Lock()
+
+
+class SinContenedor(RuntimeError):
+    """No hay configuración para acceder a los blobs (ni AZURE_STORAGE_KEY_FLASK ni CONTENEDOR_LOCAL)."""
+
+
+def crear_contenedor_asincrono():
+    """ContainerClient de azure.storage.blob.aio; se llama dentro del event loop de los blobs."""
+    import aiohttp
+    from azure.core.pipeline.transport import AioHttpTransport
+    from azure.storage.blob.aio import ContainerClient as ContainerClientAsincrono
+    from azure.storage.blob.aio import ExponentialRetry as ExponentialRetryAsincrono
+
+    # Sesión aiohttp compartida por todas las peticiones del proceso, con un máximo de conexiones abiertas
+    sesion = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=BLOB_POOL_MAXIMO))
+    # Creado directamente (no desde un BlobServiceClient) para que al cerrarlo se cierre también la sesión
+    return ContainerClientAsincrono.from_connection_string(
+        connect_str, container_name,
+        transport=AioHttpTransport(session=sesion, session_owner=True,
+                                   connection_timeout=BLOB_TIMEOUT_CONEXION, read_timeout=BLOB_TIMEOUT_LECTURA),
+        retry_policy=ExponentialRetryAsincrono(**opciones_reintentos),
+        **opciones_blob,
     )
-    
-    # Asegúrate de que la columna 'Fecha' está en formato de fecha
-    merged['Fecha'] = pd.to_datetime(merged['Fecha'])
 
-    # Truncar horas para mantener solo Año, Mes y Día
-    merged['Fecha'] = merged['Fecha'].dt.floor('d')
 
-    # Reemplazar NaN en 'Numero de cuenta' por 0
-    merged['Numero de cuenta'] = merged['Numero de cuenta'].replace({'undefined': None}).fillna(0)
+def crear_contenedor():
+    """Cliente del contenedor según la configuración (carpeta local o Azure, síncrono o asíncrono)."""
+    from asincrono import ContenedorAsincrono
+    from contenedor_local import ContenedorLocal, ContenedorLocalAsincrono
+
+    if CONTENEDOR_LOCAL and BLOB_ASINCRONO:
+        return ContenedorAsincrono(lambda: ContenedorLocalAsincrono(CONTENEDOR_LOCAL))
+    if CONTENEDOR_LOCAL:
+        return ContenedorLocal(CONTENEDOR_LOCAL)
+    if not connect_str:
+        raise SinContenedor('Falta la variable de entorno AZURE_STORAGE_KEY_FLASK (o CONTENEDOR_LOCAL)')
+    if BLOB_ASINCRONO:
+        contenedor = ContenedorAsincrono(crear_contenedor_asincrono)
+        # Cierra la sesión aiohttp al salir para no dejar conexiones abiertas
+        atexit.register(contenedor.cerrar)
+        return contenedor
+
+    import requests
+    from azure.core.pipeline.transport import RequestsTransport
+    from azure.storage.blob import BlobServiceClient, ExponentialRetry
+    from requests.adapters import HTTPAdapter
+
+    # Sesión HTTP compartida: un pool de conexiones reutilizado por todas las descargas del blob
+    sesion_blob = requests.Session()
+    sesion_blob.mount('https://', HTTPAdapter(
+        pool_connections=int(os.getenv('BLOB_POOL_CONEXIONES', '4')),
+        pool_maxsize=BLOB_POOL_MAXIMO))
+
+    blob_service_client = BlobServiceClient.from_connection_string(
+        connect_str,
+        transport=RequestsTransport(session=sesion_blob, session_owner=False,
+                                    connection_timeout=BLOB_TIMEOUT_CONEXION,
+                                    read_timeout=BLOB_TIMEOUT_LECTURA),
+        retry_policy=ExponentialRetry(**opciones_reintentos),
+        **opciones_blob,
+    )
+    return blob_service_client.get_container_client(container_name)
+
+
+def obtener_contenedor():
+    """Cliente del contenedor, creado la primera vez que se pide (lanza SinContenedor si no está configurado)."""
+    global container_client
+    if container_client is None:
+        with _lock_contenedor:
+            if container_client is None:
+                container_client = crear_contenedor()
+    return container_client
+
+
+# Refresco en segundo plano de los datasets (0 = desactivado) y precarga opcional al arrancar
+REFRESCO_SEGUNDOS = int(os.getenv('REFRESCO_SEGUNDOS', '0'))
+PRECALENTAR = os.getenv('PRECALENTAR', '0') == '1'
+
+# Se crea durante el arranque, cuando ya hay cliente del contenedor
+refrescador = None
+
+# Filas por página de cada tabla (por defecto y máximo que se puede pedir con `tamano`)
+TAMANO_PAGINA = int(os.getenv('TAMANO_PAGINA', '100'))
+TAMANO_PAGINA_MAX = int(os.getenv('TAMANO_PAGINA_MAX', '1000'))
+
+# Instrumentación: cabecera Server-Timing con la duración de cada etapa (opcional) y volcado con
+# cProfile de las peticiones que tarden más que el umbral (solo si se indica una carpeta)
+SERVER_TIMING = os.getenv('SERVER_TIMING', '0') == '1'
+perfilador = Perfilador(os.getenv('PERFIL_DIR'), float(os.getenv('PERFIL_UMBRAL_SEGUNDOS', '1')))
+
+# Número de fragmentos de la plantilla que se agrupan en cada bloque de la respuesta en streaming
+FRAGMENTOS_POR_BLOQUE = int(os.getenv('FRAGMENTOS_POR_BLOQUE', '200'))
+
+# Versión del código que genera las páginas y exportaciones (entra en los ETag); VERSION_APP
+# permite distinguir además despliegues cuyo cambio no está en estos archivos
+_carpeta = os.path.dirname(os.path.abspath(__file__))
+version_respuestas = HuellaArchivos(
+    [os.path.join(_carpeta, nombre) for nombre in
+     ('templates/index.html', 'app.py', 'agregados.py', 'datos.py', 'exportar.py', 'vinculos.py')],
+    os.getenv('VERSION_APP', ''))
+
+
+class Arranque:
+    """Carga inicial en segundo plano: la aplicación atiende peticiones (y /listo) mientras tanto.
+
+    1. Importa los módulos de datos y abre el último snapshot local publicado del mes en curso
+       (o del anterior), sin consultar los blobs.
+    2. Crea el cliente del contenedor y el Refrescador; con PRECALENTAR hace una primera pasada.
+
+    Se ejecuta una vez en cada proceso: si la aplicación se creó antes de un fork (p. ej.
+    `gunicorn --preload`) el hilo del padre no existe en los workers, que lo lanzan con su
+    primera petición.
+    """
+
+    def __init__(self):
+        self.terminado = threading.Event()
+        self.error = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self.terminado = threading.Event()
+                self.error = None
+                threading.Thread(target=self._ejecutar, name='arranque', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _ejecutar(self):
+        global refrescador
+        try:
+            with medir('arranque'):
+                from datos import Refrescador, cache_datasets, mes_anterior
+
+                mes = datetime.datetime.now().strftime('%m%Y')
+                for candidato in (mes, mes_anterior(mes)):
+                    if cache_datasets.cargar_local(candidato) is not None:
+                        break
+
+                try:
+                    contenedor = obtener_contenedor()
+                except SinContenedor as error:
+                    # Sin acceso a los blobs solo se sirve lo que haya en los snapshots locales
+                    logger.warning('%s: solo se servirán los snapshots locales', error)
+                    return
+                refrescador = Refrescador(cache_datasets, contenedor, REFRESCO_SEGUNDOS)
+                try:
+                    if PRECALENTAR:
+                        refrescador.refrescar()
+                finally:
+                    # Aunque falle la primera pasada, el refresco periódico vuelve a intentarlo
+                    refrescador.iniciar()
+        except Exception as error:
+            logger.exception('Error durante el arranque')
+            self.error = str(error)
+        finally:
+            self.terminado.set()
+
+
+arranque = Arranque()
+
+
+def crear_app():
+    """Crea la aplicación Flask y lanza el arranque en segundo plano (ver `Arranque`).
+
+    Crear la aplicación no importa pandas ni el SDK de Azure ni se conecta a nada, así que
+    un worker nuevo empieza a aceptar peticiones de inmediato; /listo indica cuándo terminó la carga.
+    """
+    aplicacion = Flask(__name__)
+    aplicacion.register_blueprint(informe)
+    arranque.iniciar()
+    return aplicacion
+
+
+def __getattr__(nombre):
+    # `app` (p. ej. `gunicorn app:app`) se crea al pedirla por primera vez, no al importar el módulo
+    global app
+    if nombre == 'app':
+        with _lock_app:
+            if 'app' not in globals():
+                app = crear_app()
+        return globals()['app']
+    raise AttributeError(f'module {__name__!r} has no attribute {nombre!r}')
+
+
+@medir('dataset')
+def obtener_dataset(fecha_inicio=None, fecha_final=None):
+    from azure.core.exceptions import ResourceNotFoundError
+    from datos import cache_datasets, mes_anterior, meses_en_rango
+
+    # Si el refrescador está activo él vigila los blobs y no hace falta consultarlos aquí; sin
+    # contenedor configurado solo se sirve lo que ya esté en cache (p. ej. cargado de un snapshot local)
+    try:
+        contenedor = obtener_contenedor()
+    except SinContenedor:
+        contenedor = None
+    revalidar = contenedor is not None and not (refrescador is not None and refrescador.activo)
+
+    # Con un rango de fechas se cargan (en paralelo) todos los meses que abarca
+    if fecha_inicio and fecha_final:
+        try:
+            meses = meses_en_rango(fecha_inicio, fecha_final)
+        except ValueError as error:
+            abort(400, str(error))
+        try:
+            return cache_datasets.obtener_rango(contenedor, meses, revalidar=revalidar)
+        except ResourceNotFoundError:
+            abort(404, 'No hay archivos para el rango de fechas seleccionado')
+
+    # Obtener la fecha actual para construir el nombre del archivo
+    fecha_actual = datetime.datetime.now().strftime('%m%Y')  # Formato: MMYYYY
+
+    # Obtener el dataset procesado desde la cache (solo se descarga si cambió algún blob)
+    try:
+        return cache_datasets.obtener(contenedor, fecha_actual, revalidar=revalidar)
+    except ResourceNotFoundError:
+        # El archivo del mes todavía no se ha subido (p. ej. el día 1): mostrar el mes anterior
+        try:
+            return cache_datasets.obtener(contenedor, mes_anterior(fecha_actual), revalidar=revalidar)
+        except ResourceNotFoundError:
+            if contenedor is None:
+                abort(503, 'No hay datos en cache y no está configurado el acceso a los blobs')
+            raise
+
+
+@informe.before_app_request
+def asegurar_arranque():
+    # En un worker creado con fork tras `crear_app` el arranque aún no se ha lanzado
+    arranque.iniciar()
+
+
+@informe.before_app_request
+def iniciar_medicion():
+    iniciar_peticion()
+    g.inicio_peticion = time.perf_counter()
+    g.perfil = perfilador.iniciar()
+
+
+@informe.after_app_request
+def registrar_medicion(respuesta):
+    # La cabecera solo incluye lo medido antes de empezar a enviar el cuerpo (no el renderizado en streaming)
+    if SERVER_TIMING:
+        respuesta.headers['Server-Timing'] = server_timing()
+
+    # La duración total y el perfil se cierran cuando termina de enviarse la respuesta
+    ruta = request.url_rule.rule if request.url_rule else 'desconocida'
+    inicio, perfil = g.inicio_peticion, g.pop('perfil', None)
+
+    def al_cerrar():
+        metricas.observar('informe_peticion_segundos', time.perf_counter() - inicio, ruta=ruta)
+        perfilador.terminar(perfil, ruta.strip('/').split('/')[0].replace('<', '').replace('>', '') or 'index')
+
+    respuesta.call_on_close(al_cerrar)
+    return respuesta
+
+
+@informe.route('/metrics')
+def metrics():
+    # Métricas del proceso en formato de texto de Prometheus
+    return Response(metricas.texto(), mimetype='text/plain; version=0.0.4')
+
+
+@informe.route('/listo')
+def listo():
+    # Readiness: 503 mientras dura el arranque en segundo plano, 200 (con los meses en cache) al terminar
+    if not arranque.terminado.is_set():
+        return jsonify(listo=False), 503
+    from datos import cache_datasets
+
+    return jsonify(listo=True, meses=sorted(cache_datasets.versiones()), error=arranque.error)
+
+
+def fecha_de_consulta(nombre):
+    # Fecha AAAA-MM-DD de la query string como datetime.date (None si no viene); 400 si no es válida.
+    # Se valida aquí una sola vez: fromisoformat acepta también '20261001' o '2026-W40-1', que
+    # numpy no interpreta igual y dejarían las tablas vacías o fallarían más adelante
+    valor = request.args.get(nombre)
+    if not valor:
+        return None
+    try:
+        return datetime.datetime.strptime(valor, '%Y-%m-%d').date()
+    except ValueError:
+        abort(400, f'Fecha no válida en {nombre}: {valor!r} (se espera AAAA-MM-DD)')
+
+
+def filtros_de_consulta():
+    # Leer los filtros de la query string (los usan los endpoints de detalle)
+    return (fecha_de_consulta('fecha_inicio'), fecha_de_consulta('fecha_final'),
+            request.args.getlist('estado_operacion'))
+
+
+@informe.route('/detalle/email/<path:email>')
+def detalle_email(email):
+    # Pedidos asociados a un correo, respetando los mismos filtros que la tabla
+    from datos import filtrar
+
+    filtros = filtros_de_consulta()
+    filas = filtrar(obtener_dataset(*filtros[:2]).detalle('Email Cliente', email), *filtros)
+    pedidos = filas[['Numero de cuenta', 'Pedido', 'Terminacion de la Tarjeta', 'Monto', 'Estatus Homologado']].drop_duplicates()
+    pedidos.columns = ['numero_cuenta', 'pedido', 'terminacion', 'monto', 'estatus']
+    pedidos = pedidos.astype(object).where(pedidos.notna(), None)
+    return jsonify(email=email, pedidos=pedidos.to_dict(orient='records'))
+
+
+@informe.route('/detalle/cuenta/<int(signed=True):numero>')
+def detalle_cuenta(numero):
+    # Correos distintos asociados a un número de cuenta, respetando los mismos filtros
+    # (del índice de vínculos, sin recorrer las transacciones)
+    filtros = filtros_de_consulta()
+    correos = obtener_dataset(*filtros[:2]).vinculos.correos_de_cuenta(numero, *filtros)
+    return jsonify(numero_cuenta=numero, correos=correos)
+
+
+@informe.route('/vinculos/<any(cuentas, correos):lado>')
+def vinculos(lado):
+    # Cuentas vinculadas a más de `minimo` correos distintos (o correos vinculados a más de
+    # `minimo` cuentas) con los mismos filtros, de mayor a menor número de vínculos
+    filtros = filtros_de_consulta()
+    minimo = max(request.args.get('minimo', 1, type=int), 0)
+    limite = min(max(request.args.get('limite', TAMANO_PAGINA_MAX, type=int), 1), TAMANO_PAGINA_MAX)
+    with medir('vinculos'):
+        valores, conteos = obtener_dataset(*filtros[:2]).vinculos.vinculados(lado, minimo, *filtros)
+    clave = 'numero_cuenta' if lado == 'cuentas' else 'email'
+    return jsonify(minimo=minimo, total=len(valores),
+                   resultados=[{clave: valor, 'vinculos': conteo}
+                               for valor, conteo in zip(valores[:limite].tolist(), conteos[:limite].tolist())])
 
-    # Asegurarse de que la columna 'Numero de cuenta' sea un entero
-    merged['Numero de cuenta'] = merged['Numero de cuenta'].astype(int)
 
-    # Obtener las fechas únicas para los filtros
-    fechas_unicas = merged['Fecha'].dt.date.unique()
+@informe.app_template_filter('miles')
+def formato_miles(valor):
+    # Formatear números con separadores de miles
+    return f"{valor:,}"
+
+
+@informe.app_template_filter('dolares')
+def formato_dolares(valor):
+    # Formatear montos con símbolo de dólar y dos decimales
+    return f"${valor:,.2f}"
+
+
+def render_stream(nombre_plantilla, etag, codificacion, **contexto):
+    # Renderizar una plantilla compilada (Jinja la guarda en cache) como respuesta en streaming,
+    # agrupando la salida en bloques para no enviar cada fila por separado. La salida se
+    # comprime por bloques y, si llega completa al cliente, se guarda en la cache de respuestas
+    plantilla = current_app.jinja_env.get_template(nombre_plantilla)
+    current_app.update_template_context(contexto)
+    flujo = plantilla.stream(contexto)
+    flujo.enable_buffering(FRAGMENTOS_POR_BLOQUE)
+    bloques = cache_respuestas.guardar_al_terminar(etag, codificar(flujo, codificacion))
+    respuesta = respuesta_html(stream_with_context(bloques), etag, codificacion)
+
+    # El renderizado ocurre mientras se envía la respuesta: se mide hasta que termina de enviarse
+    inicio = time.perf_counter()
+    respuesta.call_on_close(lambda: metricas.observar('informe_etapa_segundos', time.perf_counter() - inicio, etapa='render'))
+    return respuesta
+
+
+def respuesta_html(cuerpo, etag, codificacion, mimetype='text/html'):
+    # Cabeceras comunes: ETag fuerte, revalidación obligatoria y variante según Accept-Encoding
+    respuesta = Response(cuerpo, mimetype=mimetype)
+    respuesta.set_etag(etag)
+    respuesta.cache_control.no_cache = True
+    respuesta.vary.add('Accept-Encoding')
+    if codificacion != 'identity':
+        respuesta.content_encoding = codificacion
+    return respuesta
+
+
+def filtros_de_formulario():
+    # Filtros de la página principal normalizados (mismo orden, sin vacíos) para usarlos como clave de cache
+    fecha_inicio = fecha_de_consulta('fecha_inicio')
+    fecha_final = fecha_de_consulta('fecha_final')
+    estados_seleccionados = sorted(set(request.args.getlist('estado_operacion')))
+    ordenar_por = request.args.get('ordenar_por') or None
+    return fecha_inicio, fecha_final, estados_seleccionados, ordenar_por
+
+
+def filtros_para_enlaces(fecha_inicio, fecha_final, estados_seleccionados, ordenar_por):
+    # Query string con los filtros normalizados, para los enlaces de exportación
+    return urlencode({'fecha_inicio': fecha_inicio or '', 'fecha_final': fecha_final or '',
+                      'estado_operacion': estados_seleccionados, 'ordenar_por': ordenar_por or ''}, doseq=True)
+
+
+def paginacion_de_consulta():
+    # Página (desde 1) y filas por página pedidas, acotadas a valores válidos
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    tamano = min(max(request.args.get('tamano', TAMANO_PAGINA, type=int), 1), TAMANO_PAGINA_MAX)
+    return pagina, tamano
+
+
+def enlace_pagina(pagina):
+    # URL de otra página conservando el resto de filtros de la consulta
+    argumentos = request.args.to_dict(flat=False)
+    argumentos['pagina'] = [str(pagina)]
+    return url_for('.index') + '?' + urlencode(argumentos, doseq=True)
+
+
+@informe.route('/', methods=['GET', 'POST'])
+def index():
+    from agregados import correos_distintos, ordenar, resumen_montos
+
+    # El formulario se envía por GET para que los resultados se puedan cachear y enlazar;
+    # un POST antiguo se redirige a la URL equivalente
+    if request.method == 'POST':
+        return redirect(url_for('.index') + '?' + urlencode(request.form.to_dict(flat=False), doseq=True), code=303)
+
+    # Leer los filtros de la query string (solo se filtra si se envió el formulario)
+    filtrado = bool(request.args)
+    fecha_inicio, fecha_final, estados_seleccionados, ordenar_por = filtros_de_formulario()
+    pagina, tamano = paginacion_de_consulta()
+    tablas = None  # Datos de las tres tablas (solo si se filtra por estado)
+    filtros_detalle = ''  # Filtros que se reenvían a los endpoints de detalle
+    filtros_exportar = filtros_para_enlaces(fecha_inicio, fecha_final, estados_seleccionados, ordenar_por)
+    paginacion = None  # Página actual y enlaces a la anterior/siguiente
+
+    # Cargar los meses del rango seleccionado (o el mes en curso si no hay rango)
+    dataset = obtener_dataset(fecha_inicio, fecha_final)
+
+    # La página depende solo de la versión del código y de los datos (blobs y reglas de
+    # homologación), de los filtros y del prefijo bajo el que se sirve la app (sus enlaces lo
+    # incluyen): si el navegador ya la tiene se responde 304, y si otro usuario pidió lo mismo
+    # se reenvía la ya renderizada
+    codificacion = elegir_codificacion(request.accept_encodings)
+    etag = huella(version_respuestas(), dataset.version, dataset.reglas, filtrado, fecha_inicio, fecha_final,
+                  estados_seleccionados, ordenar_por, pagina, tamano, request.script_root, codificacion)
+    if request.if_none_match.contains_weak(etag):
+        contar('informe_respuestas_304_total')
+        respuesta = respuesta_html(b'', etag, codificacion)
+        respuesta.status_code = 304
+        return respuesta
+    cuerpo = cache_respuestas.obtener(etag)
+    registrar_cache('respuestas', cuerpo is not None)
+    if cuerpo is not None:
+        return respuesta_html(cuerpo, etag, codificacion)
+
+    # Obtener las fechas únicas para los filtros (del cubo diario, sin recorrer las transacciones)
+    cubo_correos = dataset.cubo['email']
+    fechas_unicas = cubo_correos['Fecha'].dt.date.unique()
     fechas_unicas.sort()
 
     # Obtener los estados únicos para el filtro de estado de operación
-    estados_unicos = merged['Estado de Operacion'].unique()
-
-    # Inicializar variables para las fechas seleccionadas
-    fecha_inicio = None
-    fecha_final = None
-    estados_seleccionados = []  # Inicializa una lista para los estados seleccionados
-    table_html = ''  # Inicializar la variable de la tabla
+    estados_unicos = cubo_correos['Estado de Operacion'].unique()
 
     # Filtrar por fecha y estado si se envían datos del formulario
-    if request.method == 'POST':
-        fecha_inicio = request.form.get('fecha_inicio')
-        fecha_final = request.form.get('fecha_final')
-        estados_seleccionados = request.form.getlist('estado_operacion')  # Obtener lista de estados seleccionados
-        ordenar_por = request.form.get('ordenar_por')  # Obtener el criterio de ordenación
-
-        if fecha_inicio and fecha_final:
-            merged = merged[(merged['Fecha'] >= fecha_inicio) & (merged['Fecha'] <= fecha_final)]
+    if filtrado:
+        # Las tablas se calculan sobre el cubo diario, no sobre las transacciones
+        with medir('filtro'):
+            cubo_email = dataset.filtrar('email', fecha_inicio, fecha_final, estados_seleccionados)
+            cubo_cuenta = dataset.filtrar('cuenta', fecha_inicio, fecha_final, estados_seleccionados)
+        filtros_detalle = urlencode({'fecha_inicio': fecha_inicio or '', 'fecha_final': fecha_final or '',
+                                     'estado_operacion': estados_seleccionados}, doseq=True)
 
         if estados_seleccionados:
-            merged = merged[merged['Estado de Operacion'].isin(estados_seleccionados)]
-
-            # Crear la primera tabla
-            resumen = merged.groupby(['Email Cliente', 'Estatus Homologado']).agg(
-                Cantidad=('Monto', 'size'),  # Cuenta la cantidad de transacciones (número de filas)
-                Suma_Monto=('Monto', 'sum')  # Suma los montos
-            ).reset_index()
-
-            resultado = pd.pivot_table(
-                resumen, 
-                index='Email Cliente', 
-                columns='Estatus Homologado', 
-                values=['Cantidad', 'Suma_Monto'], 
-                fill_value=0
-            ).reset_index()
-
-            resultado.columns = ['Email Cliente', 
-                                 'Aprobada (#)', 'Rechazada (#)', 
-                                 'Aprobada ($)', 'Rechazada ($)']
-
-            resultado['Aprobada (#)'] = resultado['Aprobada (#)'].astype(int)
-            resultado['Rechazada (#)'] = resultado['Rechazada (#)'].astype(int)
-
-            # Limpiar y convertir a float antes de la suma
-            resultado['Aprobada ($)'] = resultado['Aprobada ($)'].replace({'\\$': '', ',': ''}, regex=True).astype(float)
-            resultado['Rechazada ($)'] = resultado['Rechazada ($)'].replace({'\\$': '', ',': ''}, regex=True).astype(float)
-
-            resultado['Total (#)'] = resultado['Aprobada (#)'] + resultado['Rechazada (#)']
-            resultado['Total ($)'] = resultado['Aprobada ($)'] + resultado['Rechazada ($)']
-            
-            # Formatear montos en dólares para la visualización
-            resultado['Aprobada ($)'] = resultado['Aprobada ($)'].apply(lambda x: f"${x:,.2f}")
-            resultado['Rechazada ($)'] = resultado['Rechazada ($)'].apply(lambda x: f"${x:,.2f}")
-            resultado['Total ($)'] = resultado['Total ($)'].apply(lambda x: f"${x:,.2f}")
-            
-            ## Ordenar el resultado según el filtro de ordenación
-            if ordenar_por == "Aprobada (#)":
-                resultado = resultado.sort_values(by='Aprobada (#)', ascending=False)
-            elif ordenar_por == "Rechazada (#)":
-                resultado = resultado.sort_values(by='Rechazada (#)', ascending=False)
-            
-            # Crear la tabla HTML de la primera tabla
-            table_html += '''
-            <div style="display: flex; flex-wrap: wrap; margin: 10px;">
-                <div style="flex: 1; margin: 10px;">
-                    <h2 style="text-align: center;">Resumen de Transacciones por Cliente</h2>
-                    <table>
-                        <thead>
-                            <tr>
-                                <th></th>
-                                <th>Email Cliente</th>
-                                <th>Aprobada (#)</th>
-                                <th>Aprobada ($)</th>
-                                <th>Rechazada (#)</th>
-                                <th>Rechazada ($)</th>
-                                <th>Total (#)</th>
-                                <th>Total ($)</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-            '''
-
-            # Añadir filas de datos a la primera tabla HTML
-            for index, row in resultado.iterrows():
-                email = row['Email Cliente']
-                
-                # Fila principal con el botón de expansión para cuentas
-                table_html += f'''
-                    <tr>
-                        <td><button onclick="toggleVisibility('row{index}')">+</button></td>
-                        <td>{email}</td>
-                        <td>{row['Aprobada (#)']}</td>
-                        <td>{row['Aprobada ($)']}</td>
-                        <td>{row['Rechazada (#)']}</td>
-                        <td>{row['Rechazada ($)']}</td>
-                        <td>{row['Total (#)']}</td>
-                        <td>{row['Total ($)']}</td>
-                    </tr>
-                '''
-                
-                # Obtener números de cuenta y pedidos asociados al correo
-                cuentas_asociadas = merged[['Email Cliente', 'Numero de cuenta', 'Pedido', 'Terminacion de la Tarjeta', 'Monto', 'Estatus Homologado']].drop_duplicates()
-                cuentas_asociadas = cuentas_asociadas[cuentas_asociadas['Email Cliente'] == email]
-                
-                # Fila oculta con los números de cuenta y el monto
-                table_html += f'''
-                    <tr id="row{index}" class="hidden">
-                        <td colspan="8" class="left-align"> <!-- Cambiar a left-align aquí -->
-                            <ul>
-                '''
-                for cuenta_index, cuenta in cuentas_asociadas.iterrows():
-                    numero_cuenta = cuenta["Numero de cuenta"]
-                    pedido = cuenta["Pedido"]
-                    terminacion = cuenta["Terminacion de la Tarjeta"]
-                    monto = cuenta["Monto"]
-                    estatus = cuenta["Estatus Homologado"]
-                    
-                    # Formatear monto con símbolo de dólar
-                    monto_formateado = f"${monto:,.2f}"
-
-                    # Usar un identificador único para cada elemento
-                    unique_id = f'pedido{index}_{cuenta_index}'
-
-                    # Mostrar el número de cuenta con el monto y detalles
-                    table_html += f'''
-                        <li>{numero_cuenta} - {estatus} - Monto: {monto_formateado}
-                            <button onclick="toggleVisibility('{unique_id}')">Ver Detalles</button>
-                            <ul id="{unique_id}" class="hidden">
-                                <li>Pedido: {pedido}</li>
-                                <li>Terminación de la Tarjeta: {terminacion}</li>
-                            </ul>
-                        </li>
-                    '''
-                table_html += '''
-                            </ul>
-                        </td>
-                    </tr>
-                '''
-
-            # Calcular totales al final de la primera tabla
-            total_aprobada_count = resultado['Aprobada (#)'].replace({',': ''}, regex=True).astype(int).sum()  # Asegúrate de que es un número
-            total_rechazada_count = resultado['Rechazada (#)'].replace({',': ''}, regex=True).astype(int).sum()  # Asegúrate de que es un número
-            total_aprobada_sum = resultado['Aprobada ($)'].replace({'\\$': '', ',': ''}, regex=True).astype(float).sum()  # Sumar solo valores numéricos
-            total_rechazada_sum = resultado['Rechazada ($)'].replace({'\\$': '', ',': ''}, regex=True).astype(float).sum()
-            total_count = total_aprobada_count + total_rechazada_count  # Esto ya es un número
-            total_sum = total_aprobada_sum + total_rechazada_sum
-
-            # Agregar fila de totales a la primera tabla
-            table_html += f'''
-                        <tr class="total-row">
-                            <td colspan="2">Totales</td>
-                            <td>{total_aprobada_count:,}</td> <!-- Formatear con separadores de miles -->
-                            <td>${total_aprobada_sum:,.2f}</td> <!-- Asegúrate de que esto es float -->
-                            <td>{total_rechazada_count:,}</td> <!-- Formatear con separadores de miles -->
-                            <td>${total_rechazada_sum:,.2f}</td> <!-- Asegúrate de que esto es float -->
-                            <td>{total_count:,}</td> <!-- Formatear con separadores de miles -->
-                            <td>${total_sum:,.2f}</td> <!-- Asegúrate de que esto es float -->
-                        </tr>
-                        </tbody>
-                    </table>
-                </div>
-            </div>
-            '''
-            # Crear la segunda tabla usando la lógica proporcionada
-            merged_2 = merged.copy()  # Hacer una copia de merged
-            merged_2['Numero de cuenta'] = merged_2['Numero de cuenta'].fillna('0')  # Reemplazar NaN por '0'
-
-            # Agrupar por 'Numero de cuenta' y 'Estatus Homologado'
-            resumen2 = merged_2.groupby(['Numero de cuenta', 'Estatus Homologado'], dropna=False).agg(
-                Cantidad=('Monto', 'size'),  # Cuenta la cantidad de transacciones (número de filas)
-                Suma_Monto=('Monto', 'sum')  # Suma los montos
-            ).reset_index()
-
-            # Crear el DataFrame final con la estructura deseada
-            resultado2 = pd.pivot_table(
-                resumen2, 
-                index='Numero de cuenta', 
-                columns='Estatus Homologado', 
-                values=['Cantidad', 'Suma_Monto'], 
-                fill_value=0
-            ).reset_index()
-
-            # Renombrar las columnas para que sean más claras
-            resultado2.columns = ['Numero de cuenta', 
-                                  'Aprobada (#)', 'Rechazada (#)', 
-                                  'Aprobada ($)', 'Rechazada ($)']
-
-            # Asegurar que las columnas de cantidad sean enteros
-            resultado2['Aprobada (#)'] = resultado2['Aprobada (#)'].replace({',': ''}, regex=True).astype(int)
-            resultado2['Rechazada (#)'] = resultado2['Rechazada (#)'].replace({',': ''}, regex=True).astype(int)
-            
-            # Ordenar el resultado de la segunda tabla según el filtro de ordenación
-            if ordenar_por == "Aprobada (#)":
-                resultado2 = resultado2.sort_values(by='Aprobada (#)', ascending=False)
-            elif ordenar_por == "Rechazada (#)":
-                resultado2 = resultado2.sort_values(by='Rechazada (#)', ascending=False)
-            
-            # Formatear columnas de cantidad con separadores de miles
-            resultado2['Aprobada (#)'] = resultado2['Aprobada (#)'].apply(lambda x: f"{x:,}")
-            resultado2['Rechazada (#)'] = resultado2['Rechazada (#)'].apply(lambda x: f"{x:,}")
-            
-            # Calcular 'Total (#)' antes de formatear
-            resultado2['Total (#)'] = resultado2['Aprobada (#)'].replace({',': ''}, regex=True).astype(int) + resultado2['Rechazada (#)'].replace({',': ''}, regex=True).astype(int)
-            
-            # Formatear 'Total (#)' con separadores de miles
-            resultado2['Total (#)'] = resultado2['Total (#)'].apply(lambda x: f"{x:,}")
-            
-            # Agregar la columna de 'Total ($)' que será la suma de los montos
-            resultado2['Total ($)'] = resultado2['Aprobada ($)'] + resultado2['Rechazada ($)']
-            
-            # Formatear montos en dólares
-            resultado2['Aprobada ($)'] = resultado2['Aprobada ($)'].apply(lambda x: f"${x:,.2f}")
-            resultado2['Rechazada ($)'] = resultado2['Rechazada ($)'].apply(lambda x: f"${x:,.2f}")
-            resultado2['Total ($)'] = resultado2['Total ($)'].apply(lambda x: f"${x:,.2f}")
-
-            # Obtener correos a la tabla de resultados
-            correo_por_cuenta = merged[['Numero de cuenta', 'Email Cliente']].drop_duplicates()
-
-            # Tabla 2: Resumen por número de cuenta
-            table_html += '''
-                <div style="flex: 1; margin: 10px;">
-                    <h2 style="text-align: center;">Resumen de Transacciones por Número de Cuenta</h2>
-                    <table>
-                        <thead>
-                            <tr>
-                                <th></th>
-                                <th>Numero de Cuenta</th>
-                                <th>Aprobada (#)</th>
-                                <th>Aprobada ($)</th>
-                                <th>Rechazada (#)</th>
-                                <th>Rechazada ($)</th>
-                                <th>Total (#)</th>
-                                <th>Total ($)</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-            '''
-
-            # Añadir filas de datos a la segunda tabla HTML
-            for index, row in resultado2.iterrows():
-                numero_cuenta = row['Numero de cuenta']
-                
-                # Fila principal con el botón de expansión para correos
-                table_html += f'''
-                    <tr>
-                        <td><button onclick="toggleVisibility('row2_{index}')">+</button></td>
-                        <td>{numero_cuenta}</td>
-                        <td>{row['Aprobada (#)']}</td>
-                        <td>{row['Aprobada ($)']}</td>
-                        <td>{row['Rechazada (#)']}</td>
-                        <td>{row['Rechazada ($)']}</td>
-                        <td>{row['Total (#)']}</td>
-                        <td>{row['Total ($)']}</td>
-                    </tr>
-                '''
-                
-                # Obtener correos asociados al número de cuenta
-                correos_asociados = correo_por_cuenta[correo_por_cuenta['Numero de cuenta'] == numero_cuenta]
-                
-                # Fila oculta con los correos asociados
-                table_html += f'''
-                    <tr id="row2_{index}" class="hidden">
-                        <td colspan="8" class="left-align"> <!-- Cambiar a left-align aquí -->
-                            <ul>
-                '''
-                for _, correo in correos_asociados.iterrows():
-                    email_cliente = correo['Email Cliente']
-                    # Mostrar el correo asociado
-                    table_html += f'<li>{email_cliente}</li>'
-                
-                table_html += '''
-                            </ul>
-                        </td>
-                    </tr>
-                '''
-
-            # Calcular totales al final de la segunda tabla
-            total_aprobada_count_2 = resultado2['Aprobada (#)'].replace({',': ''}, regex=True).astype(int).sum()
-            total_rechazada_count_2 = resultado2['Rechazada (#)'].replace({',': ''}, regex=True).astype(int).sum()
-            total_aprobada_sum_2 = resultado2['Aprobada ($)'].replace({'\\$': '', ',': ''}, regex=True).astype(float).sum()
-            total_rechazada_sum_2 = resultado2['Rechazada ($)'].replace({'\\$': '', ',': ''}, regex=True).astype(float).sum()
-            total_count_2 = total_aprobada_count_2 + total_rechazada_count_2
-            total_sum_2 = total_aprobada_sum_2 + total_rechazada_sum_2
-
-            # Agregar fila de totales a la segunda tabla
-            table_html += f'''
-                        <tr class="total-row">
-                            <td colspan="2">Totales</td>
-                            <td>{total_aprobada_count_2:,}</td>
-                            <td>${total_aprobada_sum_2:,.2f}</td>
-                            <td>{total_rechazada_count_2:,}</td>
-                            <td>${total_rechazada_sum_2:,.2f}</td>
-                            <td>{total_count_2:,}</td>
-                            <td>${total_sum_2:,.2f}</td>
-                        </tr>
-                        </tbody>
-                    </table>
-                </div>
-            '''
-            # Crear la tercera tabla para contar correos distintos
-            resumen3 = merged_2.groupby(['Numero de cuenta', 'Estatus Homologado'], dropna=False).agg(
-                Correos_Distintos=('Email Cliente', 'nunique')  # Cuenta los correos distintos
-            ).reset_index()
-
-            # Crear el DataFrame final con la estructura deseada
-            resultado3 = pd.pivot_table(
-                resumen3, 
-                index='Numero de cuenta', 
-                columns='Estatus Homologado', 
-                values='Correos_Distintos', 
-                fill_value=0
-            ).reset_index()
-
-            # Renombrar las columnas para que sean más claras
-            resultado3.columns = ['Numero de cuenta', 
-                                  'Aprobada (Correos Distintos)', 
-                                  'Rechazada (Correos Distintos)']
-            
-            # Asegurar que los valores sean enteros
-            resultado3['Aprobada (Correos Distintos)'] = resultado3['Aprobada (Correos Distintos)'].astype(int)
-            resultado3['Rechazada (Correos Distintos)'] = resultado3['Rechazada (Correos Distintos)'].astype(int)
-            
-            
-            if ordenar_por == "Aprobada (#)":
-                resultado3 = resultado3.sort_values(by='Aprobada (Correos Distintos)', ascending=False)
-            elif ordenar_por == "Rechazada (#)":
-                resultado3 = resultado3.sort_values(by='Rechazada (Correos Distintos)', ascending=False)
-            
-            # Función para formatear números con separadores de miles
-            def format_thousands(x):
-                return f"{x:,}"
-            
-            # Tabla 3: Correos Distintos por Número de Cuenta con jerarquía de correos
-            table_html += '''
-                <div style="flex: 1; margin: 10px;">
-                    <h2 style="text-align: center;">Correos Distintos por Número de Cuenta</h2>
-                    <table>
-                        <thead>
-                            <tr>
-                                <th></th>
-                                <th>Numero de Cuenta</th>
-                                <th>Aprobada (Correos Distintos)</th>
-                                <th>Rechazada (Correos Distintos)</th>
-                                <th>Total (Correos Distintos)</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-            '''
-
-            # Añadir filas de datos a la tercera tabla HTML
-            for index, row in resultado3.iterrows():
-                numero_cuenta = row['Numero de cuenta']
-                
-                # Calcular el total para cada fila
-                total_correos_distintos = row['Aprobada (Correos Distintos)'] + row['Rechazada (Correos Distintos)']
-                
-                # Fila principal con el botón de expansión
-                table_html += f'''
-                    <tr>
-                        <td><button onclick="toggleVisibility('row3_{index}')">+</button></td>
-                        <td>{numero_cuenta}</td>
-                        <td>{format_thousands(row['Aprobada (Correos Distintos)'])}</td>
-                        <td>{format_thousands(row['Rechazada (Correos Distintos)'])}</td>
-                        <td>{format_thousands(total_correos_distintos)}</td>
-                    </tr>
-                '''
-                
-                # Obtener correos asociados al número de cuenta
-                correos_asociados = correo_por_cuenta[correo_por_cuenta['Numero de cuenta'] == numero_cuenta]
-                
-                # Fila oculta con los correos asociados
-                table_html += f'''
-                    <tr id="row3_{index}" class="hidden">
-                        <td colspan="4" class="left-align"> <!-- Cambiar a left-align aquí -->
-                            <ul>
-                '''
-                for _, correo in correos_asociados.iterrows():
-                    email_cliente = correo['Email Cliente']
-                    # Mostrar el correo asociado
-                    table_html += f'<li>{email_cliente}</li>'
-                
-                table_html += '''
-                            </ul>
-                        </td>
-                    </tr>
-                '''
-
-            # Calcular totales al final de la tercera tabla
-            total_correos_aprobados = resultado3['Aprobada (Correos Distintos)'].sum()
-            total_correos_rechazados = resultado3['Rechazada (Correos Distintos)'].sum()
-            total_correos = total_correos_aprobados + total_correos_rechazados
-
-            # Agregar fila de totales a la tercera tabla
-            table_html += f'''
-                        <tr class="total-row">
-                            <td>Total</td>
-                            <td></td>
-                            <td>{format_thousands(total_correos_aprobados)}</td>
-                            <td>{format_thousands(total_correos_rechazados)}</td>
-                            <td>{format_thousands(total_correos)}</td>
-                        </tr>
-                    </tbody>
-                </table>
-                </div>
-            </div>
-            </body>
-            </html>
-            '''
-# Renderizar la plantilla
-    return render_template_string('''  
-    <!doctype html>
-    <html lang="es">
-    <head>
-        <meta charset="UTF-8">
-        <title>Resumen de Transacciones</title>
-        <style>
-            body {
-                font-family: 'Calibri Math', sans-serif; /* Tipografía Calibri Math */
+            # Agregados numéricos de las tres tablas (el formato se aplica al renderizar)
+            with medir('tabla_clientes'):
+                resultado, totales = resumen_montos(cubo_email, 'Email Cliente')
+            with medir('tabla_cuentas'):
+                resultado2, totales2 = resumen_montos(cubo_cuenta, 'Numero de cuenta')
+            with medir('tabla_correos'):
+                resultado3, totales3 = correos_distintos(dataset.vinculos, fecha_inicio, fecha_final, estados_seleccionados)
+
+            # Solo se renderiza la página pedida: se ordenan (con selección parcial) las filas
+            # hasta el final de la página y se descartan las de páginas anteriores
+            inicio, fin = (pagina - 1) * tamano, pagina * tamano
+            filas_totales = {'clientes': len(resultado), 'cuentas': len(resultado2), 'correos': len(resultado3)}
+            with medir('orden'):
+                resultado = ordenar(resultado, ordenar_por, limite=fin).iloc[inicio:]
+                resultado2 = ordenar(resultado2, ordenar_por, limite=fin).iloc[inicio:]
+                resultado3 = ordenar(resultado3, ordenar_por, 'correos', limite=fin).iloc[inicio:]
+
+            # Las filas se pasan como iteradores para que la plantilla las emita mientras se envía la respuesta
+            tablas = {
+                'clientes': {'filas': resultado.itertuples(name=None), 'totales': totales},
+                'cuentas': {'filas': resultado2.itertuples(name=None), 'totales': totales2},
+                'correos': {'filas': resultado3.itertuples(name=None), 'totales': totales3},
             }
-            .hidden { display: none; }
-            .table-container { margin-bottom: bold; }
-            .total-row { font-weight: bold; }
-            .tables-wrapper {
-                display: flex;
-                justify-content: space-between;/* Mantiene el espacio entre las tablas */
-                flex-wrap: nowrap; /* Mantiene las tablas en una sola línea */
-                overflow-x: auto; /* Permite desplazamiento horizontal si no cabe en pantalla */
-                width: 100%; /* Asegura que ocupe el 100% del contenedor */
+            for nombre, tabla in tablas.items():
+                tabla['filas_totales'] = filas_totales[nombre]
+                # Una tabla con menos filas puede no tener nada que mostrar en esta página
+                vacia = inicio >= filas_totales[nombre]
+                tabla['desde'] = 0 if vacia else inicio + 1
+                tabla['hasta'] = 0 if vacia else min(fin, filas_totales[nombre])
+
+            paginas = max(-(-max(filas_totales.values()) // tamano), 1)
+            paginacion = {
+                'pagina': pagina,
+                'paginas': paginas,
+                'tamano': tamano,
+                'anterior': enlace_pagina(pagina - 1) if pagina > 1 else None,
+                'siguiente': enlace_pagina(pagina + 1) if pagina < paginas else None,
             }
-            .table-container {
-                width: 33%; /* Ajusta el ancho de las tablas para que entren las tres lado a lado */
-                box-sizing: border-box;
-                min-width: 300px; /* Añade un ancho mínimo para las tablas */
-                margin: 0 10px; /* Espacio entre tablas */
-            }
-            table {
-                border-collapse: collapse;
-                width: 100%;
-                border: 1px solid black;
-            }
-            th, td {
-                border: 1px solid black;
-                padding: 8px;
-                text-align: right;
-            }
-            th {
-                background-color: #004080; /* Color de fondo para los encabezados */
-                color: white; /* Cambiar el color del texto a blanco */
-                text-align: center; /* Centrar texto en los encabezados */
-            }
-            h1 {
-                text-transform: uppercase; /* Título en mayúsculas */
-                text-align: center; /* Centrar el título principal */
-            }
-            .form-container {
-                display: flex;
-                align-items: center; /* Alinea verticalmente los elementos del formulario */
-                gap: 10px; /* Espacio entre los elementos */
-            }
-            
-            select {
-                background-color: #004080; /* Color de fondo de los cuadros de selección */
-                color: white; /* Color de texto en los cuadros de selección */
-                border: 1px solid #ccc; /* Borde del cuadro de selección */
-                padding: 10px; /* Espaciado interno */
-                font-size: 16px; /* Aumentar el tamaño de la fuente */
-            }
-        </style>
-        <script>
-            function toggleVisibility(id) {
-                var row = document.getElementById(id);
-                if (row.classList.contains('hidden')) {
-                    row.classList.remove('hidden');
-                } else {
-                    row.classList.add('hidden');
-                }
-            }
-        </script>
-    </head>
-    <body>
-    
-        <h1>Resumen de Transacciones</h1>
-        <form method="post" class="form-container">
-            <label for="estado_operacion">Estado de Operación:</label>
-            <select id="estado_operacion" onchange="toggleVisibility('checkboxes')">
-                <option value="">Seleccione</option>
-                <option value="Mostrar">Mostrar opciones</option>
-            </select>
-        
-            <div id="checkboxes" class="hidden">
-                {% for estado in estados_unicos %}
-                <label>
-                    <input type="checkbox" name="estado_operacion" value="{{ estado }}">
-                    {{ estado }}
-                </label><br>
-                {% endfor %}
-            </div>
-        
-            <label for="fecha_inicio">Fecha Inicio:</label>
-            <select name="fecha_inicio" id="fecha_inicio">
-                <option value="">Seleccione</option>
-                {% for fecha in fechas_unicas %}
-                <option value="{{ fecha }}">{{ fecha }}</option>
-                {% endfor %}
-            </select>
-            
-            <label for="fecha_final">Fecha Final:</label>
-            <select name="fecha_final" id="fecha_final">
-                <option value="">Seleccione</option>
-                {% for fecha in fechas_unicas %}
-                <option value="{{ fecha }}">{{ fecha }}</option>
-                {% endfor %}
-            </select>
-            
-            <label for="ordenar_por">Ordenar por:</label>
-            <select name="ordenar_por" id="ordenar_por">
-                <option value="">Seleccione</option>
-                <option value="Aprobada (#)">Aprobada (#)</option>
-                <option value="Rechazada (#)">Rechazada (#)</option>
-            </select>
-            
-            <button type="submit">Filtrar</button>
-        </form>
-
-        <div class="tables-wrapper">
-            {{ table_html | safe }}
-        </div>
-    </body>
-    </html>
-    ''', table_html=table_html, fechas_unicas=fechas_unicas, estados_unicos=estados_unicos)
+
+    # Renderizar la plantilla
+    return render_stream('index.html', etag, codificacion, tablas=tablas, fechas_unicas=fechas_unicas,
+                         estados_unicos=estados_unicos, filtros_detalle=filtros_detalle, paginacion=paginacion,
+                         filtros_exportar=filtros_exportar, fecha_inicio=fecha_inicio, fecha_final=fecha_final)
+
+
+def resumir_para_exportar(tabla, dataset, *filtros):
+    # Tabla del informe completa con los filtros y su tipo de orden (columnas de `agregados.COLUMNAS_ORDEN`)
+    from agregados import correos_distintos, resumen_montos
+
+    if tabla == 'clientes':
+        return resumen_montos(dataset.filtrar('email', *filtros), 'Email Cliente')[0], 'montos'
+    if tabla == 'cuentas':
+        return resumen_montos(dataset.filtrar('cuenta', *filtros), 'Numero de cuenta')[0], 'montos'
+    return correos_distintos(dataset.vinculos, *filtros)[0], 'correos'
+
+
+@informe.route('/exportar/<any(clientes, cuentas, correos, transacciones):tabla>.<any(csv, parquet, xlsx):formato>')
+def exportar(tabla, formato):
+    # Descarga completa (sin paginar) de una tabla del informe o de las transacciones filtradas,
+    # con los mismos filtros que la página. El archivo se genera por bloques mientras se envía
+    from agregados import ordenar
+    from exportar import FILAS_MAX_XLSX, FORMATOS, bloques_de, bloques_de_partes
+
+    fecha_inicio, fecha_final, estados_seleccionados, ordenar_por = filtros_de_formulario()
+    dataset = obtener_dataset(fecha_inicio, fecha_final)
+
+    # Parquet y xlsx ya van comprimidos; el CSV se comprime como las páginas
+    codificacion = elegir_codificacion(request.accept_encodings) if formato == 'csv' else 'identity'
+    etag = huella('exportar', version_respuestas(), dataset.version, dataset.reglas, tabla, formato, fecha_inicio,
+                  fecha_final, estados_seleccionados, ordenar_por, codificacion)
+    mimetype, convertir = FORMATOS[formato]
+    if request.if_none_match.contains_weak(etag):
+        contar('informe_respuestas_304_total')
+        respuesta = respuesta_html(b'', etag, codificacion, mimetype)
+        respuesta.status_code = 304
+        return respuesta
+
+    with medir('filtro'):
+        if tabla == 'transacciones':
+            # Las transacciones se toman por posiciones, un bloque cada vez, de cada mes en cache
+            # (un rango de varios meses no tiene un `merged` combinado)
+            partes = [(parte.merged, parte.posiciones(fecha_inicio, fecha_final, estados_seleccionados))
+                      for parte in dataset.partes]
+            filas, bloques = sum(len(posiciones) for _, posiciones in partes), bloques_de_partes(partes)
+        else:
+            resultado, tipo = resumir_para_exportar(tabla, dataset, fecha_inicio, fecha_final, estados_seleccionados)
+            resultado = ordenar(resultado, ordenar_por, tipo)
+            filas, bloques = len(resultado), bloques_de(resultado)
+    if formato == 'xlsx' and filas > FILAS_MAX_XLSX:
+        abort(400, f'El resultado tiene {filas:,} filas y no cabe en un xlsx; expórtelo como CSV o Parquet')
+
+    cuerpo = convertir(bloques)
+    if formato == 'csv':
+        cuerpo = codificar(cuerpo, codificacion)
+    respuesta = respuesta_html(stream_with_context(cuerpo), etag, codificacion, mimetype)
+    respuesta.headers['Content-Disposition'] = f'attachment; filename="{tabla}_{dataset.mes}.{formato}"'
+
+    inicio = time.perf_counter()
+    respuesta.call_on_close(lambda: metricas.observar('informe_etapa_segundos', time.perf_counter() - inicio, etapa='exportar'))
+    return respuesta
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    crear_app().run(debug=True)
     
     #######################################ESTE ES PERFECTO X2##################################
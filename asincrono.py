@@ -0,0 +1,100 @@
+import asyncio
+import os
+import threading
+
+from azure.core.exceptions import ResourceNotFoundError
+
+
+class ContenedorAsincrono:
+    """Usa un `ContainerClient` asíncrono (`azure.storage.blob.aio`) desde el código síncrono de la aplicación.
+
+    Todas las llamadas a blobs del proceso se hacen en un único event loop que corre en un
+    hilo propio: los hilos de las peticiones le envían corrutinas y esperan el resultado, así
+    las consultas de propiedades y las descargas de varios blobs (y de varios meses) se
+    solapan en el mismo loop en lugar de ocupar un hilo cada una.
+
+    `crear_cliente` se llama dentro del loop la primera vez que se usa (la sesión HTTP queda
+    ligada a él) y de nuevo en un proceso hijo tras un fork, donde el hilo del loop no existe.
+    """
+
+    def __init__(self, crear_cliente):
+        self._crear_cliente = crear_cliente
+        self._cliente = None
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ejecutar(self, funcion, *args):
+        """Ejecuta la corrutina `funcion(cliente, *args)` en el loop y devuelve su resultado (o lanza su excepción)."""
+        return asyncio.run_coroutine_threadsafe(self._llamar(funcion, *args), self._obtener_loop()).result()
+
+    def versiones(self, nombres, faltantes=False):
+        """Versión de cada blob, consultadas todas a la vez; con `faltantes` los que no existen dan None."""
+        return self.ejecutar(_versiones, nombres, faltantes)
+
+    def descargar(self, nombres, max_concurrencia):
+        """Descarga varios blobs a la vez y devuelve [(contenido, versión), ...]."""
+        return self.ejecutar(_descargar, nombres, max_concurrencia)
+
+    def listar(self):
+        """Propiedades de todos los blobs del contenedor."""
+        return self.ejecutar(_listar)
+
+    def cerrar(self):
+        if self._cliente is not None and self._pid == os.getpid():
+            self.ejecutar(_cerrar)
+
+    async def _llamar(self, funcion, *args):
+        if self._cliente is None:
+            self._cliente = self._crear_cliente()
+        return await funcion(self._cliente, *args)
+
+    def _obtener_loop(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._cliente = None
+                threading.Thread(target=self._loop.run_forever, name='blobs-aio', daemon=True).start()
+                self._pid = os.getpid()
+            return self._loop
+
+
+def version_de_blob(propiedades):
+    """Versión de un blob a partir de sus propiedades (de un listado, de sus cabeceras o de una descarga).
+
+    Azure devuelve el ETag sin comillas en los listados y entre comillas en las cabeceras:
+    se quitan para que las versiones obtenidas por cualquiera de las dos vías coincidan.
+    """
+    return (propiedades.etag or str(propiedades.last_modified)).strip('"')
+
+
+async def _version_blob(cliente, nombre, faltantes):
+    try:
+        return version_de_blob(await cliente.get_blob_client(nombre).get_blob_properties())
+    except ResourceNotFoundError:
+        if faltantes:
+            return None
+        raise
+
+
+async def _versiones(cliente, nombres, faltantes):
+    return tuple(await asyncio.gather(*(_version_blob(cliente, nombre, faltantes) for nombre in nombres)))
+
+
+async def _descargar_blob(cliente, nombre, max_concurrencia):
+    # Los blobs grandes se descargan por rangos con hasta `max_concurrencia` peticiones en vuelo
+    descarga = await cliente.download_blob(nombre, max_concurrency=max_concurrencia)
+    contenido = await descarga.readall()
+    return contenido, version_de_blob(descarga.properties)
+
+
+async def _descargar(cliente, nombres, max_concurrencia):
+    return list(await asyncio.gather(*(_descargar_blob(cliente, nombre, max_concurrencia) for nombre in nombres)))
+
+
+async def _listar(cliente):
+    return [blob async for blob in cliente.list_blobs()]
+
+
+async def _cerrar(cliente):
+    await cliente.close()
@@ -0,0 +1,220 @@
+"""Benchmarks sin conexión del informe: etapas de la ingesta, carga en frío, filtros en caliente y rangos amplios.
+
+Los datos se generan con `benchmarks.generar_datos` y se sirven con `ContenedorLocal`,
+así que no hace falta Azure. Para cada tamaño se mide cada etapa varias veces (tiempo
+mínimo y mediana) y se repite una vez más bajo tracemalloc para registrar el pico de memoria.
+
+Uso:
+    python -m benchmarks.benchmark --filas 10000 100000 --salida base.json
+    python -m benchmarks.benchmark --filas 10000 100000 --comparar base.json --tolerancia 0.25
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from urllib.parse import urlencode
+
+try:
+    import resource
+except ImportError:  # Windows: no se informa la memoria máxima del proceso
+    resource = None
+
+from benchmarks.generar_datos import generar_mes
+
+
+def meses_recientes(cantidad):
+    """Los últimos `cantidad` meses (MMYYYY) hasta el actual, del más antiguo al más reciente."""
+    meses = []
+    fecha = datetime.date.today().replace(day=1)
+    for _ in range(cantidad):
+        meses.append(fecha.strftime('%m%Y'))
+        fecha = (fecha - datetime.timedelta(days=1)).replace(day=1)
+    return meses[::-1]
+
+
+def preparar_datos(carpeta, filas, meses, correos, cuentas, sesgo):
+    """Carpeta con los xlsx de ese tamaño; solo se generan la primera vez."""
+    destino = os.path.join(carpeta, f'{filas}_{correos or "auto"}_{cuentas or "auto"}_{sesgo or "uniforme"}')
+    for i, mes in enumerate(meses):
+        if not os.path.exists(os.path.join(destino, f'Claroscore_{mes}.xlsx')):
+            print(f'Generando {filas:,} filas para {mes}...', file=sys.stderr)
+            generar_mes(destino, mes, filas, correos, cuentas, sesgo, semilla=i)
+    return destino
+
+
+def medir(funcion, repeticiones, preparar=None):
+    """Tiempo mínimo y mediano de `funcion` y su pico de memoria (en una ejecución aparte con tracemalloc)."""
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    # tracemalloc ralentiza la ejecución, por eso la memoria se mide en una pasada separada
+    if preparar:
+        preparar()
+    tracemalloc.start()
+    try:
+        funcion()
+        pico = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'min_s': min(tiempos), 'mediana_s': statistics.median(tiempos), 'pico_mb': pico / 1024 ** 2}
+
+
+def ejecutar(filas, carpeta_datos, args):
+    # Se importan aquí porque leen la configuración (CONTENEDOR_LOCAL, SNAPSHOT_DIR) al importarse
+    import app as aplicacion
+    import datos
+    from contenedor_local import ContenedorLocal
+    from respuestas import cache_respuestas
+
+    meses = meses_recientes(args.meses)
+    contenedor = ContenedorLocal(preparar_datos(carpeta_datos, filas, meses, args.correos, args.cuentas, args.sesgo))
+    aplicacion.container_client = contenedor
+    cliente = aplicacion.app.test_client()
+    mes = meses[-1]
+
+    def pedir(url):
+        respuesta = cliente.get(url)
+        respuesta.get_data()
+        if respuesta.status_code != 200:
+            raise RuntimeError(f'{url} respondió {respuesta.status_code}')
+
+    def vaciar_caches():
+        datos.cache_datasets.limpiar()
+        cache_respuestas.limpiar()
+
+    def borrar_snapshots():
+        vaciar_caches()
+        shutil.rmtree(datos.SNAPSHOT_DIR, ignore_errors=True)
+
+    # Etapas de la ingesta de un mes por separado
+    T1_blob, claroscore_blob = [contenido for contenido, _ in datos.descargar_blobs(contenedor, datos.nombres_blobs(mes))]
+    merged = datos.procesar_mes(T1_blob, claroscore_blob)
+    cubo = datos.construir_cubo(merged)
+    reglas = datos.reglas_vigentes()
+    cuentas = datos.leer_xlsx(claroscore_blob, datos.COLUMNAS_CLAROSCORE)['Campo Personalizado 34']
+    ruta = os.path.join(datos.SNAPSHOT_DIR, 'benchmark')
+    os.makedirs(datos.SNAPSHOT_DIR, exist_ok=True)
+    datos.guardar_snapshot(ruta, merged, cubo)
+    etapas = {
+        'descarga': lambda: datos.descargar_blobs(contenedor, datos.nombres_blobs(mes)),
+        'lectura_T1': lambda: datos.tipar_T1(datos.leer_xlsx(T1_blob, datos.COLUMNAS_T1)),
+        'lectura_claroscore': lambda: datos.leer_xlsx(claroscore_blob, datos.COLUMNAS_CLAROSCORE),
+        'procesar_mes': lambda: datos.procesar_mes(T1_blob, claroscore_blob),
+        'homologacion': lambda: (reglas.estatus_de(merged['Estado de Operacion']), reglas.cuentas(cuentas)),
+        'construir_cubo': lambda: datos.construir_cubo(merged),
+        'indice_vinculos': lambda: datos.IndiceVinculos.desde_cubo(cubo['cuenta_email']),
+        'guardar_snapshot': lambda: datos.guardar_snapshot(ruta, merged, cubo),
+        'cargar_snapshot': lambda: datos.cargar_snapshot(ruta),
+    }
+
+    # Escenarios completos a través de la aplicación
+    estados = list(merged['Estado de Operacion'].cat.categories)
+    primer_dia = datetime.date(int(mes[2:]), int(mes[:2]), 1)
+    filtro = '/?' + urlencode({'fecha_inicio': primer_dia, 'fecha_final': primer_dia + datetime.timedelta(days=14),
+                               'estado_operacion': estados, 'ordenar_por': 'Aprobada (#)'}, doseq=True)
+    primer_mes = datetime.date(int(meses[0][2:]), int(meses[0][:2]), 1)
+    rango = '/?' + urlencode({'fecha_inicio': primer_mes, 'fecha_final': datetime.date.today(),
+                              'estado_operacion': estados, 'ordenar_por': 'Rechazada (#)'}, doseq=True)
+    # (función, preparación antes de cada repetición, si se ejecuta una vez antes de medir para calentar las caches)
+    escenarios = {
+        'carga_fria': (lambda: pedir('/'), borrar_snapshots, False),
+        'arranque_con_snapshot': (lambda: pedir('/'), vaciar_caches, False),
+        'filtro_caliente': (lambda: pedir(filtro), cache_respuestas.limpiar, True),
+        'filtro_repetido': (lambda: pedir(filtro), None, True),
+        'rango_amplio': (lambda: pedir(rango), cache_respuestas.limpiar, True),
+    }
+
+    resultados = []
+    for nombre, funcion in etapas.items():
+        resultados.append({'filas': filas, 'etapa': nombre, **medir(funcion, args.repeticiones)})
+    for nombre, (funcion, preparar, calentar) in escenarios.items():
+        if calentar:
+            funcion()
+        resultados.append({'filas': filas, 'etapa': nombre, **medir(funcion, args.repeticiones, preparar)})
+    shutil.rmtree(ruta, ignore_errors=True)
+    return resultados
+
+
+def comparar(resultados, anteriores, tolerancia, minimo):
+    """Etapas cuya mediana empeoró más que `tolerancia` (fracción) respecto a una ejecución anterior.
+
+    Las diferencias de menos de `minimo` segundos se ignoran (son ruido de medición).
+    """
+    base = {(r['filas'], r['etapa']): r for r in anteriores}
+    regresiones = []
+    for resultado in resultados:
+        anterior = base.get((resultado['filas'], resultado['etapa']))
+        if anterior and resultado['mediana_s'] > anterior['mediana_s'] * (1 + tolerancia) \
+                and resultado['mediana_s'] - anterior['mediana_s'] > minimo:
+            regresiones.append((resultado, anterior))
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--filas', type=int, nargs='+', default=[10_000, 100_000], help='Filas de T1 por mes')
+    parser.add_argument('--meses', type=int, default=2, help='Meses generados (el rango amplio los abarca todos)')
+    parser.add_argument('--correos', type=int, help='Correos distintos por mes')
+    parser.add_argument('--cuentas', type=int, help='Números de cuenta distintos por mes')
+    parser.add_argument('--sesgo', type=float, help='Exponente de Zipf de los correos (por defecto uniforme)')
+    parser.add_argument('--repeticiones', type=int, default=3)
+    parser.add_argument('--datos', default=os.path.join(tempfile.gettempdir(), 'benchmark_datos'),
+                        help='Carpeta donde se guardan los xlsx generados (se reutilizan entre ejecuciones)')
+    parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior con el que comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.25, help='Empeoramiento admitido al comparar')
+    parser.add_argument('--minimo', type=float, default=0.005, help='Diferencia mínima (s) para considerar una regresión')
+    args = parser.parse_args()
+
+    # Configuración de la aplicación antes de importarla: contenedor local, snapshots temporales y sin refresco
+    os.makedirs(args.datos, exist_ok=True)
+    os.environ['CONTENEDOR_LOCAL'] = args.datos
+    os.environ['SNAPSHOT_DIR'] = tempfile.mkdtemp(prefix='benchmark_snapshots_')
+    os.environ['REFRESCO_SEGUNDOS'] = '0'
+    os.environ['PRECALENTAR'] = '0'
+
+    resultados = []
+    try:
+        for filas in args.filas:
+            resultados.extend(ejecutar(filas, args.datos, args))
+    finally:
+        shutil.rmtree(os.environ['SNAPSHOT_DIR'], ignore_errors=True)
+
+    print(f'{"filas":>10} {"etapa":<24} {"mín (s)":>10} {"mediana (s)":>12} {"pico (MB)":>10}')
+    for r in resultados:
+        print(f'{r["filas"]:>10,} {r["etapa"]:<24} {r["min_s"]:>10.4f} {r["mediana_s"]:>12.4f} {r["pico_mb"]:>10.1f}')
+    if resource is not None:
+        # ru_maxrss está en KB en Linux y en bytes en macOS
+        maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+        print(f'Memoria máxima del proceso: {maximo:.1f} MB')
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            json.dump({'python': platform.python_version(), 'plataforma': platform.platform(),
+                       'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'resultados': resultados}, archivo, indent=2)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            regresiones = comparar(resultados, json.load(archivo)['resultados'], args.tolerancia, args.minimo)
+        for actual, anterior in regresiones:
+            print(f'REGRESIÓN {actual["filas"]:,} filas, {actual["etapa"]}: '
+                  f'{anterior["mediana_s"]:.4f}s -> {actual["mediana_s"]:.4f}s', file=sys.stderr)
+        if regresiones:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
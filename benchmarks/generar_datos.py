@@ -0,0 +1,111 @@
+"""Genera archivos T1_MMYYYY.xlsx y Claroscore_MMYYYY.xlsx sintéticos con la forma de los reales.
+
+Uso:
+    python -m benchmarks.generar_datos --destino datos_prueba --filas 100000 --meses 102026 092026
+"""
+import argparse
+import datetime
+import os
+
+import numpy as np
+import openpyxl
+
+# Filas de datos que caben en una hoja de Excel (1.048.576 filas menos el encabezado)
+FILAS_MAX_XLSX = 1_048_575
+
+ESTADOS = ['Completada', 'Cancelada', 'Reembolso Parcial', 'Reembolsada',
+           'Rechazada por banco', 'Rechazada por antifraude', 'Fallida', 'Pendiente']
+# Frecuencia aproximada de cada estado (la mayoría de operaciones se completan)
+PESOS_ESTADOS = [0.55, 0.05, 0.02, 0.03, 0.15, 0.08, 0.07, 0.05]
+
+# Encabezados tal como llegan en los archivos reales (con los acentos mal codificados en T1)
+ENCABEZADOS_T1 = ['Fecha', 'Estado de OperaciÃ³n', 'Email Cliente', 'Pedido', 'TerminaciÃ³n de la Tarjeta', 'Monto']
+ENCABEZADOS_CLAROSCORE = ['ID de compra', 'Campo Personalizado 34']
+
+
+def _escribir_xlsx(ruta, encabezados, columnas):
+    # Modo write_only: las filas se escriben en streaming sin construir la hoja en memoria
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    hoja.append(encabezados)
+    for fila in zip(*columnas):
+        hoja.append(fila)
+    libro.save(ruta)
+
+
+def generar_mes(destino, mes, filas, correos=None, cuentas=None, sesgo=None, columnas_extra=4,
+                sin_cuenta=0.05, sin_claroscore=0.1, duplicados=0.01, semilla=0):
+    """Escribe el par de archivos de un mes (MMYYYY) en `destino` y devuelve sus rutas.
+
+    - `correos` / `cuentas`: cantidad de correos y números de cuenta distintos
+      (por defecto uno cada 5 y cada 10 filas).
+    - `sesgo`: exponente de Zipf (> 1) para que pocos correos concentren muchas operaciones;
+      sin él los correos se reparten de forma uniforme.
+    - `columnas_extra`: columnas de relleno que la aplicación no lee, como en los archivos reales.
+    - `sin_cuenta`: fracción de cuentas 'undefined' en Claroscore.
+    - `sin_claroscore`: fracción de pedidos de T1 que no aparecen en Claroscore.
+    - `duplicados`: fracción de filas de Claroscore repetidas.
+    """
+    if filas > FILAS_MAX_XLSX:
+        raise ValueError(f'Un xlsx admite como máximo {FILAS_MAX_XLSX:,} filas; para más volumen genere varios meses')
+    correos = correos or max(filas // 5, 1)
+    cuentas = cuentas or max(filas // 10, 1)
+    rng = np.random.default_rng(semilla)
+    os.makedirs(destino, exist_ok=True)
+
+    # T1: una fila por operación, con horas repartidas por todo el mes
+    inicio = datetime.datetime(int(mes[2:]), int(mes[:2]), 1)
+    fin = datetime.datetime(inicio.year + inicio.month // 12, inicio.month % 12 + 1, 1)
+    segundos = np.sort(rng.integers(0, int((fin - inicio).total_seconds()), filas))
+    fechas = [inicio + datetime.timedelta(seconds=int(s)) for s in segundos]
+    estados = np.array(ESTADOS, dtype=object)[rng.choice(len(ESTADOS), filas, p=PESOS_ESTADOS)]
+    if sesgo:
+        ids_correo = (rng.zipf(sesgo, filas) - 1) % correos
+    else:
+        ids_correo = rng.integers(0, correos, filas)
+    emails = [f'cliente{i}@correo.com' for i in ids_correo]
+    pedidos = np.arange(10_000_000, 10_000_000 + filas)
+    terminaciones = rng.integers(0, 10_000, filas)
+    montos = np.round(rng.lognormal(6, 1.2, filas), 2)
+    extra = [[f'valor{j}'] * filas for j in range(columnas_extra)]
+
+    ruta_T1 = os.path.join(destino, f'T1_{mes}.xlsx')
+    _escribir_xlsx(ruta_T1, ENCABEZADOS_T1 + [f'Columna {j}' for j in range(columnas_extra)],
+                   [fechas, estados, emails, pedidos.tolist(), terminaciones.tolist(), montos.tolist(), *extra])
+
+    # Claroscore: cuenta de cada pedido (algunos faltan, otros sin cuenta y algunas filas repetidas)
+    presentes = pedidos[rng.random(filas) >= sin_claroscore]
+    repetidos = rng.choice(presentes, int(len(presentes) * duplicados)) if len(presentes) else presentes
+    ids_compra = np.concatenate([presentes, repetidos])
+    # Cada correo tiene una cuenta asociada (salvo los pedidos sin cuenta)
+    cuenta_de_correo = rng.integers(1, cuentas + 1, correos)
+    correo_de_pedido = dict(zip(pedidos.tolist(), ids_correo.tolist()))
+    numeros = [int(cuenta_de_correo[correo_de_pedido[p]]) for p in ids_compra.tolist()]
+    numeros = ['undefined' if r < sin_cuenta else n for n, r in zip(numeros, rng.random(len(numeros)))]
+
+    ruta_claroscore = os.path.join(destino, f'Claroscore_{mes}.xlsx')
+    _escribir_xlsx(ruta_claroscore, ENCABEZADOS_CLAROSCORE + [f'Columna {j}' for j in range(columnas_extra)],
+                   [ids_compra.tolist(), numeros, *[[f'valor{j}'] * len(numeros) for j in range(columnas_extra)]])
+    return ruta_T1, ruta_claroscore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--destino', required=True, help='Carpeta donde se escriben los archivos')
+    parser.add_argument('--filas', type=int, default=100_000, help='Filas de T1 por mes')
+    parser.add_argument('--meses', nargs='+', default=[datetime.date.today().strftime('%m%Y')], help='Meses MMYYYY')
+    parser.add_argument('--correos', type=int, help='Correos distintos por mes')
+    parser.add_argument('--cuentas', type=int, help='Números de cuenta distintos por mes')
+    parser.add_argument('--sesgo', type=float, help='Exponente de Zipf para concentrar operaciones en pocos correos')
+    parser.add_argument('--columnas-extra', type=int, default=4, help='Columnas de relleno que no se leen')
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    for i, mes in enumerate(args.meses):
+        for ruta in generar_mes(args.destino, mes, args.filas, args.correos, args.cuentas, args.sesgo,
+                                args.columnas_extra, semilla=args.semilla + i):
+            print(ruta, f'{os.path.getsize(ruta) / 1024 ** 2:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import asyncio
+import datetime
+import os
+
+from azure.core.exceptions import ResourceNotFoundError
+
+
+class PropiedadesBlob:
+    """Propiedades de un archivo local con los mismos atributos que usan los datos de un blob."""
+
+    def __init__(self, ruta, nombre, listado=False):
+        estado = os.stat(ruta)
+        self.name = nombre
+        self.size = estado.st_size
+        self.last_modified = datetime.datetime.fromtimestamp(estado.st_mtime, datetime.timezone.utc)
+        # Igual que el ETag de Azure, cambia cada vez que se reescribe el archivo; como en Azure,
+        # va entre comillas en las propiedades y descargas y sin ellas en los listados
+        etag = f'0x{estado.st_mtime_ns:X}{estado.st_size:X}'
+        self.etag = etag if listado else f'"{etag}"'
+
+
+class DescargaLocal:
+    """Equivalente local de `StorageStreamDownloader`: contenido del archivo y sus propiedades."""
+
+    def __init__(self, ruta, nombre):
+        self._ruta = ruta
+        self.name = nombre
+        self.properties = PropiedadesBlob(ruta, nombre)
+        self.size = self.properties.size
+
+    def readall(self):
+        with open(self._ruta, 'rb') as archivo:
+            return archivo.read()
+
+
+class BlobLocal:
+    """Equivalente local de `BlobClient` (solo lo que usa la aplicación)."""
+
+    def __init__(self, contenedor, nombre):
+        self._contenedor = contenedor
+        self.blob_name = nombre
+
+    def get_blob_properties(self, **kwargs):
+        return PropiedadesBlob(self._contenedor.ruta(self.blob_name), self.blob_name)
+
+    def download_blob(self, **kwargs):
+        return DescargaLocal(self._contenedor.ruta(self.blob_name), self.blob_name)
+
+
+class ContenedorLocal:
+    """Sustituto de `ContainerClient` respaldado por una carpeta del disco.
+
+    Cada archivo de la carpeta es un blob con el mismo nombre. Sirve para desarrollar y
+    medir el rendimiento sin conexión a Azure (variable de entorno CONTENEDOR_LOCAL).
+    """
+
+    def __init__(self, carpeta):
+        self.carpeta = carpeta
+        self.container_name = os.path.basename(os.path.abspath(carpeta))
+
+    def ruta(self, nombre):
+        ruta = os.path.join(self.carpeta, nombre)
+        if not os.path.isfile(ruta):
+            raise ResourceNotFoundError(f'El blob {nombre} no existe en {self.carpeta}')
+        return ruta
+
+    def get_blob_client(self, blob):
+        return BlobLocal(self, blob)
+
+    def download_blob(self, blob, **kwargs):
+        return DescargaLocal(self.ruta(blob), blob)
+
+    def list_blobs(self, name_starts_with=None, **kwargs):
+        nombres = sorted(nombre for nombre in os.listdir(self.carpeta)
+                         if os.path.isfile(os.path.join(self.carpeta, nombre)))
+        return [PropiedadesBlob(os.path.join(self.carpeta, nombre), nombre, listado=True) for nombre in nombres
+                if name_starts_with is None or nombre.startswith(name_starts_with)]
+
+
+class DescargaLocalAsincrona(DescargaLocal):
+    """Equivalente local del `StorageStreamDownloader` de `azure.storage.blob.aio`."""
+
+    def __init__(self, ruta, nombre, latencia=0):
+        super().__init__(ruta, nombre)
+        self._latencia = latencia
+
+    async def readall(self):
+        await asyncio.sleep(self._latencia)
+        # La lectura del disco se hace en otro hilo para no bloquear el event loop
+        return await asyncio.to_thread(super().readall)
+
+
+class BlobLocalAsincrono(BlobLocal):
+    """Equivalente local del `BlobClient` de `azure.storage.blob.aio`."""
+
+    async def get_blob_properties(self, **kwargs):
+        await asyncio.sleep(self._contenedor.latencia)
+        return super().get_blob_properties()
+
+    async def download_blob(self, **kwargs):
+        return await self._contenedor.download_blob(self.blob_name)
+
+
+class ContenedorLocalAsincrono(ContenedorLocal):
+    """Sustituto del `ContainerClient` de `azure.storage.blob.aio` respaldado por una carpeta del disco.
+
+    `latencia` (segundos) se espera en cada llamada para simular la red y comprobar en
+    pruebas y benchmarks que las consultas y descargas se solapan.
+    """
+
+    def __init__(self, carpeta, latencia=0):
+        super().__init__(carpeta)
+        self.latencia = latencia
+
+    def get_blob_client(self, blob):
+        return BlobLocalAsincrono(self, blob)
+
+    async def download_blob(self, blob, **kwargs):
+        await asyncio.sleep(self.latencia)
+        return DescargaLocalAsincrona(self.ruta(blob), blob, self.latencia)
+
+    async def list_blobs(self, name_starts_with=None, **kwargs):
+        await asyncio.sleep(self.latencia)
+        for propiedades in super().list_blobs(name_starts_with):
+            yield propiedades
+
+    async def close(self):
+        pass
@@ -0,0 +1,1465 @@
+import collections
+import contextlib
+import datetime
+import functools
+import glob
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import operator
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from azure.core.exceptions import ResourceNotFoundError
+
+from asincrono import ContenedorAsincrono, version_de_blob
+from homologacion import ReglasHomologacion, reglas_vigentes
+from metricas import contar, medir, registrar_cache
+from vinculos import IndiceVinculos
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin lock entre procesos, cada proceso ingiere por su cuenta
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Límites de la cache de datasets mensuales (configurables por variable de entorno)
+CACHE_MESES_MAX = int(os.getenv('CACHE_MESES_MAX', '4'))
+CACHE_BYTES_MAX = int(os.getenv('CACHE_BYTES_MAX', str(2 * 1024 ** 3)))
+# Rangos de varios meses (sus cubos unidos) que se conservan; cuentan también en CACHE_BYTES_MAX
+COMBINADOS_MAX = int(os.getenv('COMBINADOS_MAX', '2'))
+
+
+class _PorProceso:
+    """Executor creado la primera vez que se usa en cada proceso.
+
+    Tras un fork (p. ej. `gunicorn --preload`) los hilos y procesos del executor del padre
+    no existen en el hijo y las tareas que se le enviaran no se ejecutarían nunca.
+    """
+
+    def __init__(self, crear):
+        self._crear = crear
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def obtener(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = self._crear()
+                    self._pid = os.getpid()
+        return self._executor
+
+
+# Descargas: rangos en paralelo dentro de cada blob y blobs distintos descargados a la vez
+BLOB_MAX_CONCURRENCIA = int(os.getenv('BLOB_MAX_CONCURRENCIA', '4'))
+_pool_blobs = _PorProceso(lambda: ThreadPoolExecutor(max_workers=int(os.getenv('BLOB_HILOS', '8')),
+                                                     thread_name_prefix='blob'))
+
+# Carga de rangos de varios meses: meses cargados en paralelo y máximo de meses por consulta
+_pool_meses = _PorProceso(lambda: ThreadPoolExecutor(max_workers=int(os.getenv('MESES_HILOS', '4')),
+                                                     thread_name_prefix='mes'))
+MESES_MAX_RANGO = int(os.getenv('MESES_MAX_RANGO', '12'))
+
+# Procesos para parsear los xlsx (read_excel no libera el GIL); 0 = procesar en el mismo hilo.
+# 'spawn' evita heredar los hilos y locks del proceso del servidor
+INGESTA_PROCESOS = int(os.getenv('INGESTA_PROCESOS', '0'))
+_pool_procesos = _PorProceso(lambda: ProcessPoolExecutor(max_workers=INGESTA_PROCESOS,
+                                                         mp_context=multiprocessing.get_context('spawn')))
+
+# Ingesta por bloques para meses muy grandes: si el xlsx de T1 pesa más de este umbral (MB) se lee en
+# bloques de INGESTA_BLOQUES_FILAS filas y nunca se construye `merged` completo en memoria (0 = nunca)
+INGESTA_BLOQUES_UMBRAL_MB = float(os.getenv('INGESTA_BLOQUES_UMBRAL_MB', '0'))
+INGESTA_BLOQUES_FILAS = int(os.getenv('INGESTA_BLOQUES_FILAS', '100000'))
+
+# Ingesta incremental: si Claroscore no cambió y T1 solo creció, se procesan únicamente las filas
+# añadidas a partir del snapshot anterior del mes (las ya procesadas se comprueban con una huella)
+INGESTA_INCREMENTAL = os.getenv('INGESTA_INCREMENTAL', '1') == '1'
+
+# Columnas que se leen de cada archivo: nombre normalizado -> encabezados aceptados en el xlsx
+# (los archivos de T1 llegan con los acentos mal codificados, p. ej. 'Estado de OperaciÃ³n')
+COLUMNAS_T1 = {
+    'Fecha': ('Fecha',),
+    'Estado de Operacion': ('Estado de OperaciÃ³n', 'Estado de Operación', 'Estado de Operacion'),
+    'Email Cliente': ('Email Cliente',),
+    'Pedido': ('Pedido',),
+    'Terminacion de la Tarjeta': ('TerminaciÃ³n de la Tarjeta', 'Terminación de la Tarjeta', 'Terminacion de la Tarjeta'),
+    'Monto': ('Monto',),
+}
+COLUMNAS_CLAROSCORE = {
+    'ID de compra': ('ID de compra',),
+    'Campo Personalizado 34': ('Campo Personalizado 34',),
+}
+
+# Carpeta local donde se publican los snapshots columnares (Arrow IPC) de cada mes; todos los
+# workers de la máquina la comparten y mapean los mismos archivos en memoria. Por defecto está
+# en la carpeta temporal (la de la aplicación puede no ser escribible); si no se puede escribir
+# en ella los meses se procesan en memoria, sin snapshot
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), 'informe_snapshots'))
+# Formato de los snapshots: se incrementa cuando cambia lo que se guarda en ellos para no abrir los antiguos
+FORMATO_SNAPSHOT = '5'
+
+
+def meses_en_rango(fecha_inicio, fecha_final):
+    """Lista de meses (MMYYYY) que cubren el rango de fechas, ambos extremos incluidos."""
+    if fecha_final < fecha_inicio:
+        fecha_inicio, fecha_final = fecha_final, fecha_inicio
+    meses = []
+    anio, mes = fecha_inicio.year, fecha_inicio.month
+    while (anio, mes) <= (fecha_final.year, fecha_final.month):
+        meses.append(f'{mes:02d}{anio}')
+        anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+    if len(meses) > MESES_MAX_RANGO:
+        raise ValueError(f'El rango abarca {len(meses)} meses (máximo {MESES_MAX_RANGO})')
+    return meses
+
+
+def mes_anterior(mes):
+    """Mes (MMYYYY) anterior al indicado."""
+    fecha = datetime.date(int(mes[2:]), int(mes[:2]), 1) - datetime.timedelta(days=1)
+    return fecha.strftime('%m%Y')
+
+
+def nombres_blobs(mes):
+    """Devuelve los nombres de los blobs T1 y Claroscore para un mes (MMYYYY)."""
+    return f'T1_{mes}.xlsx', f'Claroscore_{mes}.xlsx'
+
+
+def version_blob(container_client, nombre):
+    """Consulta solo las propiedades del blob (sin descargarlo) y devuelve su versión."""
+    return version_de_blob(container_client.get_blob_client(nombre).get_blob_properties())
+
+
+def versiones_blobs(container_client, nombres):
+    """Consulta en paralelo la versión de varios blobs."""
+    if isinstance(container_client, ContenedorAsincrono):
+        return container_client.versiones(nombres)
+    return tuple(_pool_blobs.obtener().map(lambda nombre: version_blob(container_client, nombre), nombres))
+
+
+def versiones_meses(container_client, meses):
+    """Versión de los blobs de varios meses, consultadas todas de una vez: {mes: versión}.
+
+    Los meses a los que les falta algún archivo no aparecen en el resultado.
+    """
+    nombres = [nombre for mes in meses for nombre in nombres_blobs(mes)]
+    if isinstance(container_client, ContenedorAsincrono):
+        versiones = container_client.versiones(nombres, faltantes=True)
+    else:
+        versiones = tuple(_pool_blobs.obtener().map(lambda nombre: _version_o_none(container_client, nombre), nombres))
+    por_mes = zip(meses, zip(versiones[0::2], versiones[1::2]))
+    return {mes: version for mes, version in por_mes if None not in version}
+
+
+def _version_o_none(container_client, nombre):
+    try:
+        return version_blob(container_client, nombre)
+    except ResourceNotFoundError:
+        return None
+
+
+def descargar_blob(container_client, nombre):
+    """Descarga el blob completo y devuelve (contenido, versión descargada).
+
+    Los blobs grandes se descargan por rangos (`max_chunk_get_size` del cliente) usando
+    hasta BLOB_MAX_CONCURRENCIA conexiones en paralelo.
+    """
+    if isinstance(container_client, ContenedorAsincrono):
+        return descargar_blobs(container_client, [nombre])[0]
+    descarga = container_client.download_blob(nombre, max_concurrency=BLOB_MAX_CONCURRENCIA)
+    contenido = descarga.readall()
+    contar('informe_bytes_total', len(contenido), archivo=nombre.split('_')[0])
+    return contenido, version_de_blob(descarga.properties)
+
+
+def descargar_blobs(container_client, nombres):
+    """Descarga varios blobs a la vez; el tiempo total es el del más lento y no la suma."""
+    if isinstance(container_client, ContenedorAsincrono):
+        descargas = container_client.descargar(nombres, BLOB_MAX_CONCURRENCIA)
+        for nombre, (contenido, _) in zip(nombres, descargas):
+            contar('informe_bytes_total', len(contenido), archivo=nombre.split('_')[0])
+        return descargas
+    return list(_pool_blobs.obtener().map(lambda nombre: descargar_blob(container_client, nombre), nombres))
+
+
+def listar_blobs(container_client):
+    """Propiedades de todos los blobs del contenedor (nombre, ETag, ...)."""
+    if isinstance(container_client, ContenedorAsincrono):
+        return container_client.listar()
+    return list(container_client.list_blobs())
+
+
+def iterar_xlsx(contenido, columnas, filas_por_bloque=None, huella=None, omitir=0, huella_omitidas=None):
+    """Lee la primera hoja de un xlsx en modo solo lectura y produce DataFrames por bloques.
+
+    Solo se extraen las celdas de `columnas` (dict nombre normalizado -> encabezados
+    aceptados), que se renombran al leer. Con `filas_por_bloque=None` se produce un único
+    DataFrame. Si falta alguna columna se lanza KeyError, igual que al seleccionarla en pandas.
+
+    Para la ingesta incremental, `huella` (un objeto de hashlib) se actualiza con los valores
+    de cada fila leída y las primeras `omitir` filas no se devuelven; si su huella no coincide
+    con `huella_omitidas` (o el archivo tiene menos filas) se lanza `_ReingestaCompleta`.
+    """
+    import openpyxl  # solo hace falta al ingerir; no se importa al arrancar
+
+    libro = openpyxl.load_workbook(io.BytesIO(contenido), read_only=True, data_only=True)
+    try:
+        hoja = libro.worksheets[0]
+        # Muchos programas escriben mal la dimensión de la hoja (<dimension ref=...>) y en modo solo
+        # lectura openpyxl se limitaría a ella; read_excel también la descarta
+        hoja.reset_dimensions()
+        filas = hoja.iter_rows(values_only=True)
+        encabezado = ['' if celda is None else str(celda).strip() for celda in next(filas, ())]
+
+        posiciones = []
+        for nombre, aceptados in columnas.items():
+            posicion = next((encabezado.index(aceptado) for aceptado in aceptados if aceptado in encabezado), None)
+            if posicion is None:
+                raise KeyError(f"No se encontró la columna '{nombre}' en el archivo")
+            posiciones.append(posicion)
+        extraer = operator.itemgetter(*posiciones)
+        ancho = max(posiciones) + 1
+
+        bloque = []
+        emitidos = 0
+        vacias = 0  # Filas vacías aún no emitidas: solo se conservan si después hay más datos
+        vacia = (None,) * len(posiciones)
+        for fila in filas:
+            if len(fila) < ancho:
+                fila = tuple(fila) + (None,) * (ancho - len(fila))
+            valores = extraer(fila)
+            if omitir:
+                # Fila ya procesada en una ingesta anterior: solo cuenta para la huella
+                omitir -= 1
+                if huella is not None:
+                    huella.update(repr(valores).encode('utf-8'))
+                if not omitir and huella_omitidas is not None and huella.hexdigest() != huella_omitidas:
+                    raise _ReingestaCompleta('cambiaron filas de T1 ya procesadas')
+                continue
+            if valores == vacia:
+                vacias += 1
+                continue
+            if huella is not None:
+                for valor in [vacia] * vacias + [valores]:
+                    huella.update(repr(valor).encode('utf-8'))
+            bloque.extend([vacia] * vacias)
+            vacias = 0
+            bloque.append(valores)
+            if filas_por_bloque and len(bloque) >= filas_por_bloque:
+                yield pd.DataFrame.from_records(bloque, columns=list(columnas))
+                emitidos += 1
+                bloque = []
+
+        if omitir:
+            raise _ReingestaCompleta('T1 tiene menos filas que las ya procesadas')
+        # Las filas vacías del final se descartan, como hace read_excel
+        if bloque or not emitidos:
+            yield pd.DataFrame.from_records(bloque, columns=list(columnas))
+    finally:
+        libro.close()
+
+
+def leer_xlsx(contenido, columnas, huella=None):
+    """Lee las `columnas` de la primera hoja de un xlsx en un único DataFrame."""
+    return next(iterar_xlsx(contenido, columnas, huella=huella))
+
+
+def tipar_T1(T1):
+    """Aplica tipos explícitos a las columnas de T1; las de pocos valores distintos pasan a categóricas."""
+    T1['Fecha'] = pd.to_datetime(T1['Fecha'])
+    T1['Monto'] = pd.to_numeric(T1['Monto'], errors='coerce').astype('float64')
+    # Identificador, no cantidad: como texto aunque casi siempre sean números (p. ej. '0123')
+    T1['Terminacion de la Tarjeta'] = _como_texto(T1['Terminacion de la Tarjeta']).astype('str')
+    T1['Estado de Operacion'] = T1['Estado de Operacion'].astype('category')
+    T1['Email Cliente'] = T1['Email Cliente'].astype('category')
+    return T1
+
+
+def normalizar_claves(pedido, id_compra):
+    """Da el mismo tipo a 'Pedido' e 'ID de compra' para el merge: numérico si ambas lo son, texto si no."""
+    pedido_numerico = pd.to_numeric(pedido, errors='coerce')
+    id_numerico = pd.to_numeric(id_compra, errors='coerce')
+    if pedido_numerico.notna().sum() == pedido.notna().sum() and id_numerico.notna().sum() == id_compra.notna().sum():
+        return pedido_numerico, id_numerico
+    return pedido.astype('string'), id_compra.astype('string')
+
+
+def procesar_mes(T1_blob, claroscore_blob, estado=None, reglas=None):
+    """Construye el DataFrame `merged` a partir de los archivos T1 y Claroscore.
+
+    Si se pasa `estado` (EstadoIngesta) se anota en él lo necesario para que la próxima
+    versión del mes pueda ingerirse de forma incremental. Las columnas derivadas se calculan
+    con `reglas` (ReglasHomologacion), por defecto las vigentes.
+    """
+    reglas = reglas or reglas_vigentes()
+    huella = hashlib.sha1() if estado is not None else None
+    # Cargar solo las columnas necesarias de cada archivo (lectura en streaming y con tipos explícitos)
+    with medir('lectura_T1'):
+        T1_fil = tipar_T1(leer_xlsx(T1_blob, COLUMNAS_T1, huella))
+    with medir('lectura_claroscore'):
+        Claroscore_fil = leer_xlsx(claroscore_blob, COLUMNAS_CLAROSCORE)
+    contar('informe_filas_total', len(T1_fil), etapa='lectura_T1')
+    contar('informe_filas_total', len(Claroscore_fil), etapa='lectura_claroscore')
+
+    with medir('merge'):
+        T1_fil['Pedido'], Claroscore_fil['ID de compra'] = normalizar_claves(T1_fil['Pedido'], Claroscore_fil['ID de compra'])
+        Claroscore_fil = Claroscore_fil.drop_duplicates()
+        if estado is not None:
+            estado.anotar(len(T1_fil), huella, Claroscore_fil, pd.api.types.is_numeric_dtype(T1_fil['Pedido']))
+        merged = _unir(T1_fil, Claroscore_fil, reglas)
+    contar('informe_filas_total', len(merged), etapa='merge')
+    return merged
+
+
+def _unir(T1_fil, Claroscore_fil, reglas):
+    # Unión de T1 con la cuenta de cada pedido en Claroscore (con claves ya normalizadas y sin duplicados)
+    merged = pd.merge(T1_fil, Claroscore_fil[['ID de compra', 'Campo Personalizado 34']],
+                      how='left', left_on='Pedido', right_on='ID de compra')
+
+    merged = merged.rename(columns={'Campo Personalizado 34': 'Numero de cuenta'})
+    merged = merged.drop(columns=['ID de compra'])
+
+    # Ordenar por fecha para que los filtros de rango sean cortes contiguos
+    return ordenar_por_fecha(_completar(merged, reglas))
+
+
+def _completar(merged, reglas):
+    # Columnas derivadas de `merged` (las mismas al procesar el mes completo o por bloques)
+    with medir('homologacion'):
+        merged['Estatus Homologado'] = reglas.estatus_de(merged['Estado de Operacion'])
+        merged['Numero de cuenta'] = reglas.cuentas(merged['Numero de cuenta'])
+
+    # 'Pedido' se une con Claroscore como número si todos lo son, pero en `merged` queda como texto:
+    # así tiene el mismo tipo en todos los meses, se hayan ingerido completos o por bloques
+    merged['Pedido'] = _como_texto(merged['Pedido']).astype('str')
+
+    # Truncar horas para mantener solo Año, Mes y Día
+    merged['Fecha'] = merged['Fecha'].dt.floor('d')
+    return merged
+
+
+class _ReingestaCompleta(Exception):
+    """El snapshot anterior del mes no sirve de base para una ingesta incremental: hay que procesarlo completo."""
+
+
+class _ClavesNoNumericas(_ReingestaCompleta):
+    """Algún 'Pedido' de T1 no es numérico: hay que unir por texto (como `normalizar_claves`)."""
+
+
+def usar_bloques(T1_blob):
+    """Indica si el mes se procesa por bloques según el tamaño del xlsx de T1."""
+    return INGESTA_BLOQUES_UMBRAL_MB > 0 and len(T1_blob) > INGESTA_BLOQUES_UMBRAL_MB * 1024 ** 2
+
+
+def procesar_mes_por_bloques(T1_blob, claroscore_blob, ruta_merged, filas_por_bloque=None, estado=None, reglas=None):
+    """Variante de `procesar_mes` + `construir_cubo` con memoria acotada para meses muy grandes.
+
+    T1 se lee por bloques; cada bloque se une con un índice hash de Claroscore
+    ('ID de compra' -> 'Campo Personalizado 34'), se escribe en `ruta_merged` (Arrow IPC)
+    y se acumula en el cubo. Nunca hay más de un bloque de transacciones en memoria.
+    Devuelve el cubo, con el mismo contenido que `construir_cubo(procesar_mes(...))`, y
+    anota en `estado` (si se pasa) lo necesario para una ingesta incremental posterior.
+    """
+    filas_por_bloque = filas_por_bloque or INGESTA_BLOQUES_FILAS
+    reglas = reglas or reglas_vigentes()
+    with medir('lectura_claroscore'):
+        claroscore = leer_xlsx(claroscore_blob, COLUMNAS_CLAROSCORE)
+    contar('informe_filas_total', len(claroscore), etapa='lectura_claroscore')
+
+    # Igual que `normalizar_claves`: se une por número solo si todas las claves de ambos archivos
+    # lo son. Lo de Claroscore se sabe de antemano; si algún bloque de T1 no lo es se repite por texto
+    ids = claroscore['ID de compra']
+    if pd.to_numeric(ids, errors='coerce').notna().sum() == ids.notna().sum():
+        try:
+            return _agregar_por_bloques(T1_blob, claroscore, True, ruta_merged, filas_por_bloque, estado, reglas)
+        except _ClavesNoNumericas:
+            logger.info('T1 tiene pedidos no numéricos: se vuelve a procesar uniendo por texto')
+    return _agregar_por_bloques(T1_blob, claroscore, False, ruta_merged, filas_por_bloque, estado, reglas)
+
+
+def _agregar_por_bloques(T1_blob, claroscore, numerico, ruta_merged, filas_por_bloque, estado, reglas):
+    ids = pd.to_numeric(claroscore['ID de compra']) if numerico else claroscore['ID de compra'].astype('string')
+    claroscore = pd.DataFrame({'ID de compra': ids, 'Campo Personalizado 34': claroscore['Campo Personalizado 34']})
+    claroscore = claroscore.drop_duplicates()
+    buscador = _BuscadorCuentas(claroscore, numerico, reglas)
+
+    huella = hashlib.sha1()
+    filas = 0
+    cubo = {}
+    with _EscritorMerged(ruta_merged) as escritor:
+        for T1 in iterar_xlsx(T1_blob, COLUMNAS_T1, filas_por_bloque, huella=huella):
+            filas += len(T1)
+            _, cubo = _agregar_bloque(T1, buscador, escritor, cubo)
+
+    if estado is not None:
+        estado.anotar(filas, huella, claroscore, numerico, por_bloques=True)
+    return _categorizar_cubo(cubo)
+
+
+def _agregar_bloque(T1, buscador, escritor, cubo):
+    # Une un bloque de T1, lo escribe en `merged` (si hay `escritor`) y suma sus agregados al cubo.
+    # Devuelve el bloque unido y el cubo acumulado
+    with medir('lectura_T1'):
+        T1 = tipar_T1(T1)
+    contar('informe_filas_total', len(T1), etapa='lectura_T1')
+
+    with medir('merge'):
+        bloque = buscador.unir(T1)
+    contar('informe_filas_total', len(bloque), etapa='merge')
+
+    if escritor is not None:
+        escritor.escribir(bloque)
+    return bloque, _sumar_cubos(cubo, construir_cubo(bloque))
+
+
+class _BuscadorCuentas:
+    """Cuenta de cada pedido según Claroscore (ya normalizado y sin duplicados), para unir T1 por bloques.
+
+    Si los IDs son únicos se usa un índice hash construido una sola vez; si hay IDs
+    repetidos (con cuentas distintas) se une con merge, igual que `_unir`.
+    """
+
+    def __init__(self, claroscore, numerico, reglas):
+        self.numerico = numerico
+        self.reglas = reglas
+        self.claroscore = claroscore.astype({'Campo Personalizado 34': object})
+        self.indice = pd.Index(claroscore['ID de compra'])
+        self.cuentas = np.append(self.claroscore['Campo Personalizado 34'].to_numpy(), None)  # -1 -> None
+
+    def unir(self, T1):
+        T1['Pedido'] = _normalizar_pedidos(T1['Pedido'], self.numerico)
+        if self.indice.is_unique:
+            bloque = T1.assign(**{'Numero de cuenta': self.cuentas[self.indice.get_indexer(T1['Pedido'])]})
+        else:
+            bloque = pd.merge(T1, self.claroscore, how='left', left_on='Pedido', right_on='ID de compra')
+            bloque = bloque.rename(columns={'Campo Personalizado 34': 'Numero de cuenta'})
+            bloque = bloque.drop(columns=['ID de compra'])
+        return _completar(bloque, self.reglas)
+
+
+def _normalizar_pedidos(pedido, numerico):
+    # Misma conversión que `normalizar_claves`, con el tipo de clave ya decidido para todo el mes
+    if numerico:
+        pedido_numerico = pd.to_numeric(pedido, errors='coerce')
+        if pedido_numerico.notna().sum() != pedido.notna().sum():
+            raise _ClavesNoNumericas('hay pedidos no numéricos')
+        return pedido_numerico
+    # En un bloque sin textos los pedidos pueden llegar como float (por celdas vacías)
+    return _como_texto(pedido.astype(object)).astype('string')
+
+
+# Esquema de `merged` en los snapshots, el mismo en la ingesta completa, por bloques e incremental.
+# Los textos que se repiten van como diccionario (se leen como categóricas)
+ESQUEMA_MERGED = pa.schema([
+    ('Fecha', pa.timestamp('us')),
+    ('Estado de Operacion', pa.dictionary(pa.int32(), pa.string())),
+    ('Email Cliente', pa.dictionary(pa.int32(), pa.string())),
+    ('Pedido', pa.string()),
+    ('Terminacion de la Tarjeta', pa.string()),
+    ('Monto', pa.float64()),
+    ('Numero de cuenta', pa.int64()),
+    ('Estatus Homologado', pa.dictionary(pa.int32(), pa.string())),
+])
+
+
+class _EscritorMerged:
+    """Escribe `merged` en Arrow IPC con ESQUEMA_MERGED, de una vez o bloque a bloque.
+
+    Un archivo IPC solo admite un diccionario por columna que únicamente puede crecer (deltas):
+    cada bloque se codifica con el diccionario acumulado de los anteriores más sus valores nuevos.
+    """
+
+    def __init__(self, ruta):
+        self._escritor = pa.ipc.new_file(ruta, ESQUEMA_MERGED,
+                                         options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+        # Columna de diccionario -> (valores ya escritos como Index, los mismos como array de Arrow)
+        self._diccionarios = {campo.name: (pd.Index([], dtype=object), pa.array([], pa.string()))
+                              for campo in ESQUEMA_MERGED if pa.types.is_dictionary(campo.type)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *error):
+        self._escritor.close()
+
+    def copiar(self, lote):
+        """Escribe un lote leído de otro archivo con este esquema (su diccionario es el acumulado)."""
+        for nombre in self._diccionarios:
+            diccionario = lote.column(nombre).dictionary
+            self._diccionarios[nombre] = (pd.Index(diccionario.to_pandas(), dtype=object), diccionario)
+        self._escritor.write_batch(lote)
+
+    def escribir(self, df):
+        columnas = [self._codificar(campo.name, df[campo.name]) if campo.name in self._diccionarios
+                    else pa.array(df[campo.name], type=campo.type, from_pandas=True)
+                    for campo in ESQUEMA_MERGED]
+        # Tabla y no lote: las columnas de texto ya respaldadas por Arrow pueden venir en varios trozos
+        self._escritor.write_table(pa.table(columnas, schema=ESQUEMA_MERGED))
+
+    def _codificar(self, nombre, serie):
+        # Se traducen las categorías del bloque (no cada fila) a posiciones del diccionario acumulado
+        valores = serie.array if isinstance(serie.dtype, pd.CategoricalDtype) else pd.Categorical(serie)
+        conocidos, diccionario = self._diccionarios[nombre]
+        posiciones = conocidos.get_indexer(valores.categories)
+        nuevos = valores.categories[posiciones < 0]
+        if len(nuevos):
+            posiciones[posiciones < 0] = np.arange(len(conocidos), len(conocidos) + len(nuevos))
+            conocidos = conocidos.append(pd.Index(nuevos, dtype=object))
+            diccionario = pa.concat_arrays([diccionario, pa.array(nuevos.to_numpy(dtype=object), pa.string())])
+            self._diccionarios[nombre] = (conocidos, diccionario)
+        codigos = np.asarray(valores.codes)
+        vacios = codigos < 0
+        indices = pa.array(np.where(vacios, 0, posiciones[codigos]).astype(np.int32), mask=vacios)
+        return pa.DictionaryArray.from_arrays(indices, diccionario)
+
+
+def _como_texto(serie):
+    # Números enteros leídos como float (por celdas vacías en el bloque) se escriben sin '.0'
+    if pd.api.types.is_integer_dtype(serie):
+        # Columna ya numérica (p. ej. 'Pedido' tras unir por número): sin recorrer fila a fila
+        return serie.astype(str).astype(object)
+    return serie.map(lambda valor: None if pd.isna(valor)
+                     else str(int(valor)) if isinstance(valor, float) and valor.is_integer()
+                     else str(valor)).astype(object)
+
+
+def _sin_categorias(df):
+    # Las categorías cambian de un bloque a otro: para acumular se trabaja con los valores
+    df = df.copy()
+    for columna in ('Estado de Operacion', 'Email Cliente'):
+        if columna in df and isinstance(df[columna].dtype, pd.CategoricalDtype):
+            df[columna] = df[columna].astype(object)
+    return df
+
+
+def _sumar_cubos(acumulado, parcial):
+    """Suma al cubo `acumulado` (sin categorías) el cubo `parcial` de un bloque de filas."""
+    return {nombre: _acumular(acumulado.get(nombre), _sin_categorias(tabla), nombre) for nombre, tabla in parcial.items()}
+
+
+def _categorizar_cubo(cubo):
+    # Las columnas de texto del cubo vuelven a ser categóricas, como en `construir_cubo`
+    for tabla in cubo.values():
+        for columna in ('Estado de Operacion', 'Email Cliente'):
+            if columna in tabla:
+                tabla[columna] = tabla[columna].astype('category')
+    return cubo
+
+
+def _acumular(acumulado, parcial, nombre):
+    """Suma el cubo de un bloque al acumulado (o une los pares distintos en 'cuenta_email')."""
+    if acumulado is None:
+        return parcial
+    combinado = pd.concat([acumulado, parcial], ignore_index=True)
+    if nombre == 'cuenta_email':
+        return combinado.drop_duplicates(ignore_index=True)
+    claves = [columna for columna in combinado.columns if columna not in ('Cantidad', 'Suma_Monto')]
+    return combinado.groupby(claves, dropna=False, observed=True, sort=False)[['Cantidad', 'Suma_Monto']].sum().reset_index()
+
+
+def ordenar_por_fecha(df):
+    """Ordena `df` por 'Fecha' (orden estable, fechas vacías al final) si no lo está ya."""
+    fechas = df['Fecha'].to_numpy()
+    validas = len(fechas) - int(np.isnat(fechas).sum())
+    if not np.isnat(fechas[:validas]).any() and (fechas[1:validas] >= fechas[:validas - 1]).all():
+        return df
+    return df.sort_values('Fecha', kind='stable', na_position='last', ignore_index=True)
+
+
+def limites_por_dia(fechas):
+    """Días presentes en `fechas` (ya ordenadas) y la posición donde empieza cada uno.
+
+    Devuelve `(dias, inicios)`, con un límite más en `inicios` que marca el final de
+    las fechas válidas, así las filas del día `dias[i]` son `inicios[i]:inicios[i + 1]`.
+    """
+    valores = fechas.to_numpy()
+    valores = valores[:len(valores) - int(np.isnat(valores).sum())]
+    inicios = np.flatnonzero(valores[1:] != valores[:-1]) + 1
+    inicios = np.concatenate(([0], inicios, [len(valores)])) if len(valores) else np.zeros(1, dtype=np.int64)
+    return valores[inicios[:-1]], inicios
+
+
+def posiciones_rango(limites, fecha_inicio, fecha_final):
+    """Posiciones `(inicio, fin)` de las filas entre dos fechas (incluidas) con búsqueda binaria sobre los días."""
+    dias, inicios = limites
+    desde = np.searchsorted(dias, np.datetime64(fecha_inicio, 'D').astype(dias.dtype), side='left')
+    hasta = np.searchsorted(dias, np.datetime64(fecha_final, 'D').astype(dias.dtype), side='right')
+    return int(inicios[desde]), int(inicios[max(hasta, desde)])
+
+
+def mascara_estados(columna, estados):
+    """Máscara de las filas cuyo 'Estado de Operacion' está en `estados`.
+
+    Con una columna categórica se marca qué códigos se seleccionan y la máscara se
+    obtiene indexando esa tabla con los códigos, sin comparar ningún texto.
+    """
+    if not isinstance(columna.dtype, pd.CategoricalDtype):
+        return columna.isin(estados).to_numpy()
+    codigos = columna.cat.categories.get_indexer(estados)
+    seleccion = np.zeros(len(columna.cat.categories) + 1, dtype=bool)  # la última posición es el código -1 (vacío)
+    seleccion[codigos[codigos >= 0]] = True
+    return seleccion[columna.cat.codes.to_numpy()]
+
+
+def filtrar(df, fecha_inicio, fecha_final, estados_seleccionados, limites=None):
+    """Filtra `df` (ordenado por 'Fecha') por rango de fechas (solo si se indican ambas) y por estados.
+
+    El rango se resuelve como un corte contiguo; `limites` son los de `limites_por_dia`
+    si ya se tienen calculados para `df`.
+    """
+    if fecha_inicio and fecha_final:
+        inicio, fin = posiciones_rango(limites_por_dia(df['Fecha']) if limites is None else limites,
+                                       fecha_inicio, fecha_final)
+        df = df.iloc[inicio:fin]
+
+    if estados_seleccionados:
+        df = df[mascara_estados(df['Estado de Operacion'], estados_seleccionados)]
+
+    return df
+
+
+def indice_por_clave(df, clave):
+    """Agrupa las filas de `df` por `clave` con un único ordenamiento.
+
+    Devuelve `(orden, posiciones)`: `orden` son las posiciones de las filas de `df`
+    ordenadas por la clave (y por 'Fecha' dentro de cada clave, con las fechas vacías al
+    final) y `posiciones` un dict clave -> (inicio, fin), de modo que el grupo de cualquier
+    clave se obtiene como `df.iloc[orden[inicio:fin]]` sin copiar el resto de filas.
+    """
+    codigos, claves = pd.factorize(df[clave], sort=False)
+    fechas = df['Fecha'].to_numpy()
+    fechas = np.where(np.isnat(fechas), np.iinfo(np.int64).max, fechas.view('i8'))
+    orden = np.lexsort((fechas, codigos))
+
+    # Los valores nulos (código -1) quedan al principio y no se indexan
+    conteos = np.bincount(codigos[codigos >= 0], minlength=len(claves))
+    fines = int((codigos < 0).sum()) + np.cumsum(conteos)
+    inicios = fines - conteos
+    return orden, dict(zip(claves, zip(inicios.tolist(), fines.tolist())))
+
+
+def construir_cubo(merged):
+    """Preagrega `merged` por día y estado de operación para responder cualquier filtro.
+
+    Devuelve un dict con tres tablas, todas con las columnas 'Fecha', 'Estado de Operacion'
+    y 'Estatus Homologado' para poder filtrarlas igual que las transacciones:
+    - 'email': Cantidad y Suma_Monto por 'Email Cliente'
+    - 'cuenta': Cantidad y Suma_Monto por 'Numero de cuenta'
+    - 'cuenta_email': pares distintos cuenta/correo de cada día, para contar correos distintos
+    """
+    dimensiones = ['Fecha', 'Estado de Operacion', 'Estatus Homologado']
+    cubo = {}
+    with medir('cubo'):
+        for nombre, clave in (('email', 'Email Cliente'), ('cuenta', 'Numero de cuenta')):
+            cubo[nombre] = merged.groupby(dimensiones + [clave], dropna=False, observed=True, sort=False).agg(
+                Cantidad=('Monto', 'size'),
+                Suma_Monto=('Monto', 'sum')
+            ).reset_index()
+        cubo['cuenta_email'] = merged[dimensiones + ['Numero de cuenta', 'Email Cliente']].drop_duplicates().reset_index(drop=True)
+    return cubo
+
+
+def concatenar(frames):
+    """Concatena DataFrames manteniendo categóricas las columnas categóricas (une sus categorías)."""
+    resultado = pd.concat(frames, ignore_index=True)
+    for columna in frames[0].columns:
+        if all(isinstance(frame[columna].dtype, pd.CategoricalDtype) for frame in frames) \
+                and not isinstance(resultado[columna].dtype, pd.CategoricalDtype):
+            resultado[columna] = pd.api.types.union_categoricals(
+                [frame[columna] for frame in frames], sort_categories=True)
+    return resultado
+
+
+def ruta_snapshot(mes, version, reglas=None):
+    """Carpeta del snapshot de un mes para una versión concreta (ETags) de sus blobs.
+
+    Depende también de las reglas de homologación (`reglas` es su huella, por defecto la
+    de las vigentes): al cambiarlas los meses se vuelven a procesar aunque no cambien los blobs.
+    """
+    reglas = reglas or reglas_vigentes().huella
+    huella = hashlib.sha1('|'.join((FORMATO_SNAPSHOT, reglas, *version)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(SNAPSHOT_DIR, f'{mes}_{huella}')
+
+
+def anotar_ultimo_snapshot(mes, version):
+    """Registra `version` como la última publicada del mes, para abrirla al arrancar sin consultar los blobs."""
+    ruta = os.path.join(SNAPSHOT_DIR, f'ultimo_{mes}.json')
+    temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump({'version': list(version)}, archivo)
+        os.replace(temporal, ruta)
+    except OSError:
+        logger.exception('No se pudo registrar el último snapshot del mes %s', mes)
+
+
+def ultimo_snapshot(mes, reglas=None):
+    """`(version, ruta)` del último snapshot publicado del mes, o None si no hay ninguno utilizable."""
+    try:
+        with open(os.path.join(SNAPSHOT_DIR, f'ultimo_{mes}.json'), encoding='utf-8') as archivo:
+            version = tuple(json.load(archivo)['version'])
+    except (OSError, ValueError, KeyError):
+        return None
+    # La carpeta no existe si se publicó con otro FORMATO_SNAPSHOT u otras reglas, o ya se borró
+    ruta = ruta_snapshot(mes, version, reglas)
+    return (version, ruta) if os.path.isdir(ruta) else None
+
+
+def _escribir_arrow(ruta, df):
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(ruta, 'wb') as archivo:
+        with pa.ipc.new_file(archivo, tabla.schema) as escritor:
+            escritor.write_table(tabla)
+
+
+def _escribir_merged(ruta, merged):
+    with _EscritorMerged(ruta) as escritor:
+        escritor.escribir(merged)
+
+
+def _leer_arrow(ruta):
+    # Mapear el archivo: las columnas numéricas y los códigos de las categóricas apuntan
+    # directamente a las páginas del archivo, que el sistema comparte entre procesos
+    fuente = pa.memory_map(ruta, 'r')
+    return pa.ipc.open_file(fuente).read_all().to_pandas(split_blocks=True)
+
+
+def guardar_snapshot(ruta, merged, cubo, estado=None, reglas=None):
+    """Publica `merged` y su cubo como archivos Arrow IPC tipados y borra las versiones anteriores del mes.
+
+    Junto a ellos se guardan las reglas de homologación con las que se calcularon.
+    """
+    with publicar_snapshot(ruta) as temporal, medir('guardar_snapshot'):
+        _escribir_merged(os.path.join(temporal, 'merged.arrow'), merged)
+        _escribir_cubo(temporal, cubo)
+        (reglas or reglas_vigentes()).guardar(os.path.join(temporal, 'homologacion.json'))
+        if estado is not None:
+            estado.guardar(temporal)
+
+
+def _escribir_cubo(carpeta, cubo):
+    for nombre, tabla in cubo.items():
+        _escribir_arrow(os.path.join(carpeta, f'cubo_{nombre}.arrow'), tabla)
+    # El índice de vínculos cuenta/correo se deriva del cubo ya completo (también en la ingesta por bloques o incremental)
+    with medir('vinculos'):
+        IndiceVinculos.desde_cubo(cubo['cuenta_email']).guardar(os.path.join(carpeta, 'vinculos'))
+
+
+def guardar_snapshot_por_bloques(ruta, T1_blob, claroscore_blob, estado=None, reglas=None):
+    """Procesa el mes con `procesar_mes_por_bloques` escribiendo directamente el snapshot en `ruta`."""
+    reglas = reglas or reglas_vigentes()
+    with publicar_snapshot(ruta) as temporal:
+        cubo = procesar_mes_por_bloques(T1_blob, claroscore_blob, os.path.join(temporal, 'merged.arrow'),
+                                        estado=estado, reglas=reglas)
+        with medir('guardar_snapshot'):
+            _escribir_cubo(temporal, cubo)
+            reglas.guardar(os.path.join(temporal, 'homologacion.json'))
+            if estado is not None:
+                estado.guardar(temporal)
+
+
+class EstadoIngesta:
+    """Lo que se guarda junto al snapshot de un mes para ingerir después solo las filas nuevas de T1.
+
+    - `version_claroscore`: si Claroscore cambia hay que volver a unir todas las filas.
+    - `filas_T1` y `huella_T1`: filas de T1 ya procesadas y huella de sus valores, para
+      comprobar que el archivo solo creció por el final.
+    - `claroscore`: Claroscore normalizado y sin duplicados, para no volver a descargarlo ni leerlo.
+    - `claves_numericas`: tipo de clave usado al unir (ver `normalizar_claves`).
+    - `por_bloques`: si `merged.arrow` se escribió por bloques (sin ordenar por fecha).
+    """
+
+    def __init__(self, version_claroscore=None):
+        self.version_claroscore = version_claroscore
+        self.filas_T1 = 0
+        self.huella_T1 = None
+        self.claroscore = None
+        self.claves_numericas = None
+        self.por_bloques = False
+
+    def anotar(self, filas_T1, huella, claroscore, claves_numericas, por_bloques=False):
+        self.filas_T1 = filas_T1
+        self.huella_T1 = huella.hexdigest()
+        self.claroscore = claroscore
+        self.claves_numericas = bool(claves_numericas)
+        self.por_bloques = por_bloques
+
+    def guardar(self, carpeta):
+        # Las cuentas se guardan como texto (mezclan números y 'undefined'); al unir se convierten igual
+        claroscore = self.claroscore.assign(**{'Campo Personalizado 34': _como_texto(self.claroscore['Campo Personalizado 34'])})
+        _escribir_arrow(os.path.join(carpeta, 'claroscore.arrow'), claroscore)
+        with open(os.path.join(carpeta, 'estado.json'), 'w', encoding='utf-8') as archivo:
+            json.dump({'version_claroscore': self.version_claroscore, 'filas_T1': self.filas_T1,
+                       'huella_T1': self.huella_T1, 'claves_numericas': self.claves_numericas,
+                       'por_bloques': self.por_bloques}, archivo)
+
+    @classmethod
+    def leer(cls, carpeta):
+        """Estado guardado en un snapshot (sin Claroscore) o None si no tiene."""
+        try:
+            with open(os.path.join(carpeta, 'estado.json'), encoding='utf-8') as archivo:
+                datos = json.load(archivo)
+        except (OSError, ValueError):
+            return None
+        estado = cls(datos['version_claroscore'])
+        estado.filas_T1 = datos['filas_T1']
+        estado.huella_T1 = datos['huella_T1']
+        estado.claves_numericas = datos['claves_numericas']
+        estado.por_bloques = datos['por_bloques']
+        return estado
+
+    def cargar_claroscore(self, carpeta):
+        claroscore = _leer_arrow(os.path.join(carpeta, 'claroscore.arrow'))
+        if not self.claves_numericas:
+            claroscore['ID de compra'] = claroscore['ID de compra'].astype('string')
+        self.claroscore = claroscore
+        return claroscore
+
+
+def snapshot_base(mes, version_claroscore, reglas):
+    """Snapshot más reciente del mes que puede ampliarse con las filas nuevas de T1 (o None).
+
+    Solo sirve uno procesado con las mismas reglas de homologación (`reglas` es su huella).
+    """
+    candidatos = []
+    for ruta in glob.glob(os.path.join(SNAPSHOT_DIR, f'{mes}_*')):
+        if ruta.endswith('.tmp') or not os.path.isdir(ruta):
+            continue
+        estado = EstadoIngesta.leer(ruta)
+        if estado is not None and estado.version_claroscore == version_claroscore \
+                and _huella_reglas(ruta) == reglas:
+            candidatos.append((os.path.getmtime(ruta), ruta))
+    return max(candidatos)[1] if candidatos else None
+
+
+def _huella_reglas(carpeta):
+    # Huella de las reglas de homologación guardadas en un snapshot (None si no se pueden leer)
+    try:
+        return ReglasHomologacion.leer(os.path.join(carpeta, 'homologacion.json')).huella
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def incrementar_snapshot(T1_blob, base, ruta, reglas):
+    """Publica en `ruta` el snapshot `base` ampliado con las filas añadidas al final de T1.
+
+    Solo se leen de T1 las filas nuevas (las anteriores se recorren para comprobar su huella),
+    se unen con el Claroscore guardado en el snapshot y sus agregados se suman al cubo.
+    Lanza `_ReingestaCompleta` si alguna fila ya procesada cambió o el modo de ingesta ya no es el mismo.
+    """
+    estado = EstadoIngesta.leer(base)
+    if usar_bloques(T1_blob) and not estado.por_bloques:
+        raise _ReingestaCompleta('T1 superó el umbral de la ingesta por bloques')
+    buscador = _BuscadorCuentas(estado.cargar_claroscore(base), estado.claves_numericas, reglas)
+    merged_anterior, cubo_anterior, _ = cargar_snapshot(base)
+
+    huella = hashlib.sha1()
+    # Sin filas nuevas (p. ej. el archivo se volvió a subir igual) solo se actualiza la versión
+    bloques = (T1 for T1 in iterar_xlsx(T1_blob, COLUMNAS_T1, INGESTA_BLOQUES_FILAS, huella=huella,
+                                        omitir=estado.filas_T1, huella_omitidas=estado.huella_T1) if len(T1))
+    cubo = _sumar_cubos({}, cubo_anterior)
+    filas = 0
+    with publicar_snapshot(ruta) as temporal:
+        ruta_merged = os.path.join(temporal, 'merged.arrow')
+        if estado.por_bloques:
+            # Se copian los lotes del archivo anterior y a continuación se escriben los bloques nuevos
+            with pa.memory_map(os.path.join(base, 'merged.arrow'), 'r') as fuente, \
+                    _EscritorMerged(ruta_merged) as escritor:
+                lector = pa.ipc.open_file(fuente)
+                for i in range(lector.num_record_batches):
+                    escritor.copiar(lector.get_batch(i))
+                for T1 in bloques:
+                    filas += len(T1)
+                    _, cubo = _agregar_bloque(T1, buscador, escritor, cubo)
+            merged = None
+        else:
+            nuevos = []
+            for T1 in bloques:
+                filas += len(T1)
+                bloque, cubo = _agregar_bloque(T1, buscador, None, cubo)
+                nuevos.append(bloque)
+            merged = ordenar_por_fecha(concatenar([merged_anterior, *nuevos]))
+
+        estado.anotar(estado.filas_T1 + filas, huella, buscador.claroscore, estado.claves_numericas, estado.por_bloques)
+        with medir('guardar_snapshot'):
+            if merged is not None:
+                _escribir_merged(ruta_merged, merged)
+            _escribir_cubo(temporal, _categorizar_cubo(cubo))
+            reglas.guardar(os.path.join(temporal, 'homologacion.json'))
+            estado.guardar(temporal)
+    return filas
+
+
+@contextlib.contextmanager
+def publicar_snapshot(ruta):
+    """Carpeta temporal donde escribir un snapshot; al salir sin errores se publica en `ruta`.
+
+    El renombrado final hace que ningún proceso lector vea nunca un snapshot a medias.
+    """
+    temporal = f'{ruta}.{os.getpid()}.{threading.get_ident()}.tmp'
+    os.makedirs(temporal, exist_ok=True)
+    try:
+        yield temporal
+    except BaseException:
+        shutil.rmtree(temporal, ignore_errors=True)
+        raise
+    try:
+        os.replace(temporal, ruta)
+    except OSError:
+        # Otro proceso publicó la misma versión mientras tanto
+        shutil.rmtree(temporal, ignore_errors=True)
+        if not os.path.isdir(ruta):
+            raise
+
+    # Los procesos que aún mapean una versión anterior la conservan hasta soltarla
+    mes = os.path.basename(ruta).split('_')[0]
+    for anterior in glob.glob(os.path.join(os.path.dirname(ruta), f'{mes}_*')):
+        if anterior != ruta and not anterior.endswith('.tmp'):
+            shutil.rmtree(anterior, ignore_errors=True)
+
+
+def cargar_snapshot(ruta):
+    """Abre el snapshot mapeado en memoria y devuelve `(merged, cubo, vinculos)` sin copiar sus columnas."""
+    with medir('cargar_snapshot'):
+        merged = _leer_arrow(os.path.join(ruta, 'merged.arrow'))
+        cubo = {}
+        for archivo in sorted(glob.glob(os.path.join(ruta, 'cubo_*.arrow'))):
+            cubo[os.path.basename(archivo)[len('cubo_'):-len('.arrow')]] = _leer_arrow(archivo)
+        vinculos = IndiceVinculos.leer(os.path.join(ruta, 'vinculos'))
+    return merged, cubo, vinculos
+
+
+@contextlib.contextmanager
+def lock_entre_procesos(mes):
+    """Lock de archivo por mes: un solo proceso (worker) ingiere cada mes y el resto espera.
+
+    Lanza `_SinCarpetaSnapshots` si no se puede crear la carpeta de snapshots o escribir en ella.
+    """
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        archivo = open(os.path.join(SNAPSHOT_DIR, f'{mes}.lock'), 'w')
+    except OSError as error:
+        raise _SinCarpetaSnapshots(error) from error
+    with archivo:
+        if fcntl is None:
+            yield
+            return
+        fcntl.flock(archivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+class _SinCarpetaSnapshots(Exception):
+    """No se puede escribir en SNAPSHOT_DIR: los meses se procesan en memoria."""
+
+
+_aviso_sin_snapshots = False
+
+
+def _ingerir_en_memoria(container_client, mes, reglas, error):
+    # Sin carpeta de snapshots el mes se procesa en este proceso y solo queda en la cache en memoria
+    global _aviso_sin_snapshots
+    if not _aviso_sin_snapshots:
+        _aviso_sin_snapshots = True
+        logger.warning('No se puede usar la carpeta de snapshots %s (%s): los meses se procesan en memoria',
+                       SNAPSHOT_DIR, error)
+    with medir('descarga'):
+        (T1_blob, version_T1), (claroscore_blob, version_claroscore) = \
+            descargar_blobs(container_client, nombres_blobs(mes))
+    contar('informe_ingestas_total', tipo='completa')
+    merged = procesar_mes(T1_blob, claroscore_blob, reglas=reglas)
+    return (version_T1, version_claroscore), merged, construir_cubo(merged), None
+
+
+def _procesar_a_snapshot(T1_blob, claroscore_blob, ruta, version_claroscore=None, reglas=None):
+    # Procesa el mes completo y publica el resultado en el snapshot (en un proceso del pool o por bloques).
+    # Las reglas llegan del proceso principal: deben ser las mismas con las que se calculó `ruta`
+    estado = EstadoIngesta(version_claroscore)
+    if usar_bloques(T1_blob):
+        guardar_snapshot_por_bloques(ruta, T1_blob, claroscore_blob, estado, reglas)
+    else:
+        merged = procesar_mes(T1_blob, claroscore_blob, estado, reglas)
+        guardar_snapshot(ruta, merged, construir_cubo(merged), estado, reglas)
+    return ruta
+
+
+def _ejecutar_ingesta(funcion, *args):
+    # Con INGESTA_PROCESOS > 0 la función se ejecuta en un proceso hijo, que publica el snapshot
+    # (las etapas internas se miden en el proceso hijo, aquí solo el total)
+    if INGESTA_PROCESOS > 0:
+        with medir('procesar_mes'):
+            return _pool_procesos.obtener().submit(funcion, *args).result()
+    return funcion(*args)
+
+
+def ingerir_mes(container_client, mes, version=None, reglas=None):
+    """Etapa de ingesta: devuelve `(version, merged, cubo, vinculos)` del mes desde su snapshot o construyéndolo.
+
+    Si se conoce la versión de los blobs y ya hay un snapshot para ella, no se descarga nada.
+    En caso contrario un solo proceso (elegido con `lock_entre_procesos`) descarga ambos
+    archivos, los procesa y publica el snapshot; el resto de workers espera y lo mapea, de
+    modo que todos comparten las mismas páginas en memoria en lugar de tener su propia copia.
+    Si solo cambió T1 y hay un snapshot anterior del mes, se descarga solo T1 y se procesan
+    únicamente sus filas nuevas (ver `incrementar_snapshot`). Todo el mes se procesa con las
+    mismas `reglas` de homologación (por defecto las vigentes al empezar). Si no se puede
+    escribir en SNAPSHOT_DIR el mes se procesa en memoria (ver `_ingerir_en_memoria`).
+    """
+    reglas = reglas or reglas_vigentes()
+    if version is not None and os.path.isdir(ruta_snapshot(mes, version, reglas.huella)):
+        registrar_cache('snapshots', True)
+        return (version, *cargar_snapshot(ruta_snapshot(mes, version, reglas.huella)))
+
+    with contextlib.ExitStack() as pila:
+        try:
+            pila.enter_context(lock_entre_procesos(mes))
+        except _SinCarpetaSnapshots as error:
+            return _ingerir_en_memoria(container_client, mes, reglas, error)
+
+        # Puede que otro worker haya publicado esta versión mientras se esperaba el lock
+        if version is not None and os.path.isdir(ruta_snapshot(mes, version, reglas.huella)):
+            return (version, *cargar_snapshot(ruta_snapshot(mes, version, reglas.huella)))
+
+        base = snapshot_base(mes, version[1], reglas.huella) if INGESTA_INCREMENTAL and version is not None else None
+        T1_descargado = None
+        if base is not None:
+            with medir('descarga'):
+                T1_descargado = T1_blob, version_T1 = descargar_blob(container_client, nombres_blobs(mes)[0])
+            version = (version_T1, version[1])
+            ruta = ruta_snapshot(mes, version, reglas.huella)
+            registrar_cache('snapshots', os.path.isdir(ruta))
+            if os.path.isdir(ruta):
+                return (version, *cargar_snapshot(ruta))
+            try:
+                filas = _ejecutar_ingesta(incrementar_snapshot, T1_blob, base, ruta, reglas)
+                anotar_ultimo_snapshot(mes, version)
+                contar('informe_ingestas_total', tipo='incremental')
+                logger.info('Mes %s: %d filas nuevas de T1 añadidas al snapshot anterior', mes, filas)
+                return (version, *cargar_snapshot(ruta))
+            except _ReingestaCompleta as motivo:
+                logger.info('Mes %s: se ingiere completo (%s)', mes, motivo)
+            except OSError:
+                logger.exception('No se pudo ampliar el snapshot del mes %s; se ingiere completo', mes)
+
+        with medir('descarga'):
+            if T1_descargado is not None:
+                # T1 ya se descargó para el intento incremental: solo falta Claroscore
+                (T1_blob, version_T1), (claroscore_blob, version_claroscore) = \
+                    T1_descargado, descargar_blob(container_client, nombres_blobs(mes)[1])
+            else:
+                (T1_blob, version_T1), (claroscore_blob, version_claroscore) = \
+                    descargar_blobs(container_client, nombres_blobs(mes))
+        version = (version_T1, version_claroscore)
+        ruta = ruta_snapshot(mes, version, reglas.huella)
+        registrar_cache('snapshots', os.path.isdir(ruta))
+        if os.path.isdir(ruta):
+            return (version, *cargar_snapshot(ruta))
+        contar('informe_ingestas_total', tipo='completa')
+
+        if INGESTA_PROCESOS > 0 or usar_bloques(T1_blob):
+            # El proceso hijo (o la ingesta por bloques) publica el snapshot y aquí solo se mapea,
+            # sin copiar el DataFrame entre procesos ni tener el mes completo en memoria
+            try:
+                _ejecutar_ingesta(_procesar_a_snapshot, T1_blob, claroscore_blob, ruta, version_claroscore, reglas)
+            except (OSError, pa.ArrowException):
+                # Sin snapshot el mes se sirve desde memoria (salvo si es tan grande que va por bloques)
+                if usar_bloques(T1_blob):
+                    raise
+                logger.exception('No se pudo guardar el snapshot del mes %s; se procesa en memoria', mes)
+                merged = procesar_mes(T1_blob, claroscore_blob, reglas=reglas)
+                return version, merged, construir_cubo(merged), None
+            anotar_ultimo_snapshot(mes, version)
+            return (version, *cargar_snapshot(ruta))
+
+        estado = EstadoIngesta(version_claroscore)
+        merged = procesar_mes(T1_blob, claroscore_blob, estado, reglas)
+        cubo = construir_cubo(merged)
+        try:
+            guardar_snapshot(ruta, merged, cubo, estado, reglas)
+        except (OSError, pa.ArrowException):
+            # El mes ya está procesado: se sirve desde memoria en vez de fallar (y reintentar) cada petición
+            logger.exception('No se pudo guardar el snapshot del mes %s', mes)
+            return version, merged, cubo, None
+        anotar_ultimo_snapshot(mes, version)
+        return (version, *cargar_snapshot(ruta))
+
+
+class Dataset:
+    """Datos procesados de un mes junto con la versión (ETags) de los blobs de origen.
+
+    `reglas` es la huella de las reglas de homologación con que se procesó (None si no se sabe).
+    """
+
+    def __init__(self, mes, version, merged, cubo=None, vinculos=None, reglas=None):
+        self.mes = mes
+        self.version = version
+        self.reglas = reglas
+        # `merged` no se reordena aquí (en la ingesta por bloques está mapeado y se copiaría entero):
+        # el detalle ya devuelve cada grupo ordenado por fecha
+        self.merged = merged
+        # El cubo diario se construye al ingerir, así los filtros nunca recorren las transacciones;
+        # sus tablas se mantienen ordenadas por fecha (normalmente ya lo están y no se copia nada)
+        cubo = construir_cubo(merged) if cubo is None else cubo
+        self.cubo = {nombre: ordenar_por_fecha(tabla) for nombre, tabla in cubo.items()}
+        self.bytes_cubo = sum(int(df.memory_usage(deep=True).sum()) for df in self.cubo.values())
+        self.bytes = self.bytes_cubo + int(merged.memory_usage(deep=True).sum())
+        if vinculos is not None:
+            self.vinculos = vinculos
+            self.bytes += vinculos.bytes
+
+    @functools.cached_property
+    def indices(self):
+        # Índices de drill-down (clave -> filas), construidos una vez por versión del dataset; el
+        # detalle por cuenta se resuelve con `vinculos`, así que solo hace falta el de correos
+        return {clave: indice_por_clave(self.merged, clave) for clave in ('Email Cliente',)}
+
+    @functools.cached_property
+    def vinculos(self):
+        # Índice de vínculos cuenta/correo: viene del snapshot o, si no lo hay (p. ej. en los
+        # datasets combinados de varios meses), se construye una vez desde el cubo
+        return IndiceVinculos.desde_cubo(self.cubo['cuenta_email'])
+
+    @functools.cached_property
+    def limites(self):
+        # Límites de cada día en las tablas del cubo, para filtrar por fechas con búsqueda binaria
+        return {nombre: limites_por_dia(tabla['Fecha']) for nombre, tabla in self.cubo.items()}
+
+    def filtrar(self, nombre, fecha_inicio, fecha_final, estados_seleccionados):
+        """Corte de la tabla `nombre` del cubo para los filtros dados."""
+        return filtrar(self.cubo[nombre], fecha_inicio, fecha_final, estados_seleccionados, self.limites[nombre])
+
+    def posiciones(self, fecha_inicio, fecha_final, estados_seleccionados):
+        """Posiciones de las filas de `merged` que cumplen los filtros, con los mismos criterios que `filtrar`.
+
+        `merged` no siempre está ordenado por fecha (ingesta por bloques), así que se usa una
+        máscara en lugar de un corte; no se copia ninguna fila.
+        """
+        mascara = np.ones(len(self.merged), dtype=bool)
+        if fecha_inicio and fecha_final:
+            dias = self.merged['Fecha'].to_numpy().astype('datetime64[D]')
+            mascara &= (dias >= np.datetime64(fecha_inicio, 'D')) & (dias <= np.datetime64(fecha_final, 'D'))
+        if estados_seleccionados:
+            mascara &= mascara_estados(self.merged['Estado de Operacion'], estados_seleccionados)
+        return np.flatnonzero(mascara)
+
+    def detalle(self, clave, valor):
+        """Filas de `merged` cuya columna `clave` vale `valor`, ordenadas por fecha."""
+        orden, posiciones = self.indices[clave]
+        inicio, fin = posiciones.get(valor, (0, 0))
+        return self.merged.iloc[orden[inicio:fin]]
+
+    @property
+    def partes(self):
+        """Datasets mensuales que lo forman (él mismo si es de un solo mes)."""
+        return [self]
+
+    @classmethod
+    def combinar(cls, datasets):
+        """Une los datasets de varios meses; los cubos diarios se concatenan sin recalcularse."""
+        return DatasetCombinado(datasets)
+
+
+class DatasetCombinado(Dataset):
+    """Varios meses (en orden) vistos como un solo Dataset.
+
+    Solo se concatenan los cubos diarios, que es lo que usan las tablas y los filtros; no hay
+    `merged` combinado: el detalle y las transacciones se resuelven en cada mes con sus propios
+    índices, sin copiar las transacciones de ninguno.
+    """
+
+    def __init__(self, datasets):
+        self._partes = list(datasets)
+        self.mes = '-'.join(d.mes for d in self._partes)
+        self.version = tuple(d.version for d in self._partes)
+        reglas = {d.reglas for d in self._partes}
+        self.reglas = reglas.pop() if len(reglas) == 1 else None
+        self.cubo = {nombre: ordenar_por_fecha(concatenar([d.cubo[nombre] for d in self._partes]))
+                     for nombre in self._partes[0].cubo}
+        # Los meses ya cuentan en la cache por separado; aquí solo lo propio (los cubos unidos)
+        self.bytes_cubo = self.bytes = sum(d.bytes_cubo for d in self._partes)
+
+    @property
+    def partes(self):
+        return self._partes
+
+    @functools.cached_property
+    def vinculos(self):
+        vinculos = IndiceVinculos.desde_cubo(self.cubo['cuenta_email'])
+        self.bytes += vinculos.bytes
+        return vinculos
+
+    def posiciones(self, fecha_inicio, fecha_final, estados_seleccionados):
+        raise TypeError('Un DatasetCombinado no tiene merged: use las posiciones de cada una de sus partes')
+
+    def detalle(self, clave, valor):
+        """Filas de los `merged` de todos los meses cuya columna `clave` vale `valor`, ordenadas por fecha."""
+        return ordenar_por_fecha(concatenar([d.detalle(clave, valor) for d in self._partes]))
+
+
+class CacheDatasets:
+    """Cache en memoria de los datasets mensuales, indexada por nombre de blob y ETag.
+
+    En cada acceso solo se consultan las propiedades de los blobs; si los ETags
+    coinciden con los de la entrada en cache se reutiliza el `merged` ya procesado,
+    y si no está en memoria se intenta abrir el snapshot local antes de descargar.
+    Se expulsan los meses menos usados cuando se supera el número de meses o de bytes.
+    """
+
+    def __init__(self, max_meses=CACHE_MESES_MAX, max_bytes=CACHE_BYTES_MAX):
+        self.max_meses = max_meses
+        self.max_bytes = max_bytes
+        self._entradas = collections.OrderedDict()  # mes -> Dataset
+        self._combinados = collections.OrderedDict()  # meses y versiones -> Dataset combinado
+        self._crear_locks()
+        if hasattr(os, 'register_at_fork'):
+            # Un hilo del padre podía tener un lock tomado al hacer fork: en el hijo nunca se soltaría
+            os.register_at_fork(after_in_child=self._crear_locks)
+
+    def _crear_locks(self):
+        self._lock = threading.Lock()
+        self._locks_mes = collections.defaultdict(threading.Lock)
+
+    def obtener(self, container_client, mes, version=None, revalidar=True):
+        """Devuelve el Dataset del mes, descargando y procesando solo si cambió algún blob.
+
+        `version` permite indicar los ETags ya conocidos (p. ej. de un listado del contenedor)
+        para no volver a consultarlos. Con `revalidar=False` se devuelve lo que haya en cache
+        sin consultar los blobs; lo usa la petición cuando el Refrescador mantiene la cache al día.
+        Un mes procesado con otras reglas de homologación que las vigentes se vuelve a ingerir.
+        """
+        if not revalidar:
+            dataset = self._buscar(mes)
+            if dataset is not None:
+                registrar_cache('datasets', True)
+                return dataset
+
+        if container_client is None:
+            # Sin contenedor (acceso a los blobs sin configurar) solo se sirve lo que ya esté en cache
+            raise ResourceNotFoundError(f'El mes {mes} no está en cache y no hay acceso a los blobs')
+        if version is None:
+            with medir('version_blobs'):
+                version = versiones_blobs(container_client, nombres_blobs(mes))
+
+        reglas = reglas_vigentes()
+        dataset = self._buscar(mes, version, reglas.huella)
+        registrar_cache('datasets', dataset is not None)
+        if dataset is not None:
+            return dataset
+
+        # Un solo hilo procesa cada mes; el resto espera y reutiliza el resultado
+        with self._lock_de(mes):
+            dataset = self._buscar(mes, version, reglas.huella)
+            if dataset is not None:
+                return dataset
+
+            dataset = Dataset(mes, *ingerir_mes(container_client, mes, version, reglas), reglas=reglas.huella)
+            self._guardar(dataset)
+            return dataset
+
+    def obtener_rango(self, container_client, meses, revalidar=True):
+        """Devuelve un Dataset con todos los meses indicados, cargados en paralelo.
+
+        Los meses sin archivos se omiten; si no hay ninguno se lanza ResourceNotFoundError.
+        """
+        if revalidar:
+            # Las propiedades de todos los meses se consultan de una vez antes de cargarlos
+            with medir('version_blobs'):
+                versiones = versiones_meses(container_client, meses)
+            for mes in meses:
+                if mes not in versiones:
+                    logger.warning('No hay archivos para el mes %s', mes)
+            futuros = [(mes, _pool_meses.obtener().submit(self.obtener, container_client, mes, version=versiones[mes]))
+                       for mes in meses if mes in versiones]
+        else:
+            futuros = [(mes, _pool_meses.obtener().submit(self.obtener, container_client, mes, revalidar=False))
+                       for mes in meses]
+        datasets = []
+        for mes, futuro in futuros:
+            try:
+                datasets.append(futuro.result())
+            except ResourceNotFoundError:
+                logger.warning('No hay archivos para el mes %s', mes)
+
+        if not datasets:
+            raise ResourceNotFoundError(f'No hay archivos para los meses {", ".join(meses)}')
+        if len(datasets) == 1:
+            return datasets[0]
+
+        clave = tuple((d.mes, d.version, d.reglas) for d in datasets)
+        with self._lock:
+            combinado = self._combinados.get(clave)
+            registrar_cache('combinados', combinado is not None)
+            if combinado is not None:
+                self._combinados.move_to_end(clave)
+                return combinado
+
+        with medir('combinar_meses'):
+            combinado = Dataset.combinar(datasets)
+        with self._lock:
+            self._combinados[clave] = combinado
+            self._expulsar()
+        return combinado
+
+    def cargar_local(self, mes):
+        """Pone en cache el último snapshot publicado del mes sin consultar los blobs (arranque en frío).
+
+        Devuelve el Dataset, o None si no hay snapshot local del mes. Las peticiones que
+        revalidan siguen comparando su versión con la de los blobs antes de usarlo.
+        """
+        reglas = reglas_vigentes().huella
+        ultimo = ultimo_snapshot(mes, reglas)
+        if ultimo is None:
+            return None
+        version, ruta = ultimo
+        with self._lock_de(mes):
+            dataset = self._buscar(mes)
+            if dataset is not None:
+                return dataset
+            try:
+                dataset = Dataset(mes, version, *cargar_snapshot(ruta), reglas=reglas)
+            except OSError:
+                # Se borró al publicarse una versión más nueva mientras se abría
+                logger.exception('No se pudo abrir el snapshot local del mes %s', mes)
+                return None
+            self._guardar(dataset)
+            registrar_cache('snapshots', True)
+            return dataset
+
+    def versiones(self, reglas=None):
+        """Meses en cache y la versión (ETags) de cada uno.
+
+        Con `reglas` (huella), los meses procesados con otras reglas de homologación tienen versión None.
+        """
+        with self._lock:
+            return {mes: dataset.version if reglas is None or dataset.reglas == reglas else None
+                    for mes, dataset in self._entradas.items()}
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._combinados.clear()
+
+    def _lock_de(self, mes):
+        with self._lock:
+            return self._locks_mes[mes]
+
+    def _buscar(self, mes, version=None, reglas=None):
+        with self._lock:
+            dataset = self._entradas.get(mes)
+            if dataset is None or (version is not None and dataset.version != version) \
+                    or (reglas is not None and dataset.reglas != reglas):
+                return None
+            self._entradas.move_to_end(mes)
+            return dataset
+
+    def _guardar(self, dataset):
+        # Reemplazar la entrada es atómico: las peticiones en curso siguen con el Dataset anterior
+        with self._lock:
+            self._entradas[dataset.mes] = dataset
+            self._entradas.move_to_end(dataset.mes)
+            self._expulsar()
+
+    def _expulsar(self):
+        # Con el lock tomado. Se descartan los combinados que usan un mes que ya no está en cache
+        # (mantendrían vivo un Dataset sustituido o expulsado), y si se superan los límites, primero
+        # los combinados menos usados (se rehacen solo con sus cubos) y después los meses más
+        # antiguos (siempre se conserva el último)
+        def ocupado():
+            return sum(d.bytes for d in (*self._entradas.values(), *self._combinados.values()))
+
+        while True:
+            for clave, combinado in list(self._combinados.items()):
+                if any(self._entradas.get(d.mes) is not d for d in combinado.partes):
+                    del self._combinados[clave]
+            if self._combinados and (len(self._combinados) > COMBINADOS_MAX or ocupado() > self.max_bytes):
+                self._combinados.popitem(last=False)
+            elif len(self._entradas) > 1 and (len(self._entradas) > self.max_meses or ocupado() > self.max_bytes):
+                self._entradas.popitem(last=False)
+            else:
+                return
+
+
+class Refrescador:
+    """Mantiene la cache al día desde un hilo en segundo plano, fuera del camino de las peticiones.
+
+    Cada `intervalo` segundos lista el contenedor (una sola llamada devuelve los ETags de
+    todos los blobs) y vuelve a ingerir los meses en cache, o el mes en curso, cuyos
+    archivos sean nuevos o hayan cambiado (o que se procesaron con reglas de homologación
+    anteriores a las vigentes). El Dataset nuevo sustituye al anterior de forma
+    atómica al terminar, así que ninguna petición espera a la ingesta.
+    """
+
+    def __init__(self, cache, container_client, intervalo):
+        self.cache = cache
+        self.container_client = container_client
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self._hilo = None
+
+    @property
+    def activo(self):
+        return self._hilo is not None and self._hilo.is_alive()
+
+    def meses_a_vigilar(self, versiones_contenedor):
+        """Meses que deben estar en cache: los ya cargados y el mes en curso (o el anterior si aún no existe)."""
+        mes_actual = datetime.datetime.now().strftime('%m%Y')
+        meses = set(self.cache.versiones())
+        if all(nombre in versiones_contenedor for nombre in nombres_blobs(mes_actual)):
+            meses.add(mes_actual)
+        else:
+            meses.add(mes_anterior(mes_actual))
+        return sorted(meses, key=lambda mes: (mes[2:], mes[:2]))
+
+    def refrescar(self):
+        """Ejecuta una pasada: devuelve la lista de meses que se volvieron a ingerir."""
+        versiones_contenedor = {blob.name: version_de_blob(blob) for blob in listar_blobs(self.container_client)}
+        # Los meses procesados con reglas de homologación anteriores cuentan como cambiados
+        en_cache = self.cache.versiones(reglas_vigentes().huella)
+        actualizados = []
+        for mes in self.meses_a_vigilar(versiones_contenedor):
+            nombres = nombres_blobs(mes)
+            if not all(nombre in versiones_contenedor for nombre in nombres):
+                continue
+            version = tuple(versiones_contenedor[nombre] for nombre in nombres)
+            if en_cache.get(mes) == version:
+                continue
+            try:
+                self.cache.obtener(self.container_client, mes, version=version)
+                actualizados.append(mes)
+            except Exception:
+                logger.exception('No se pudo refrescar el mes %s', mes)
+        if actualizados:
+            logger.info('Meses refrescados: %s', ', '.join(actualizados))
+        return actualizados
+
+    def iniciar(self):
+        """Arranca el hilo de refresco (una sola vez)."""
+        if self.activo or self.intervalo <= 0:
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name='refrescador', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo):
+            try:
+                self.refrescar()
+            except Exception:
+                logger.exception('Error al listar el contenedor durante el refresco')
+
+
+cache_datasets = CacheDatasets()
@@ -0,0 +1,131 @@
+import io
+import os
+import tempfile
+
+import openpyxl
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Filas que se convierten y envían de una vez al exportar (la memoria usada no depende del total)
+EXPORTAR_FILAS_POR_BLOQUE = int(os.getenv('EXPORTAR_FILAS_POR_BLOQUE', '50000'))
+
+# Filas de datos que caben en una hoja de Excel (1.048.576 filas menos el encabezado)
+FILAS_MAX_XLSX = 1_048_575
+
+# Tamaño de cada trozo del archivo xlsx temporal que se envía
+BYTES_POR_TROZO = 1024 * 1024
+
+
+def bloques_de(df, posiciones=None, filas_por_bloque=None):
+    """Divide `df` (o solo sus filas en `posiciones`) en DataFrames de `filas_por_bloque` filas.
+
+    Cada bloque se copia solo cuando se pide, así nunca hay más de uno en memoria.
+    Siempre se produce al menos un bloque (vacío si no hay filas) para que haya encabezado.
+    """
+    filas_por_bloque = filas_por_bloque or EXPORTAR_FILAS_POR_BLOQUE
+    total = len(df) if posiciones is None else len(posiciones)
+    for inicio in range(0, max(total, 1), filas_por_bloque):
+        if posiciones is None:
+            yield df.iloc[inicio:inicio + filas_por_bloque]
+        else:
+            yield df.iloc[posiciones[inicio:inicio + filas_por_bloque]]
+
+
+def bloques_de_partes(partes, filas_por_bloque=None):
+    """Como `bloques_de`, uno tras otro, para varios pares `(df, posiciones)` (p. ej. uno por mes).
+
+    Las partes sin filas se omiten, salvo si no hay ninguna con filas (el bloque vacío del encabezado).
+    """
+    con_filas = [(df, posiciones) for df, posiciones in partes if len(posiciones)] or partes[:1]
+    for df, posiciones in con_filas:
+        yield from bloques_de(df, posiciones, filas_por_bloque)
+
+
+def a_csv(bloques):
+    """Texto CSV por bloques (con BOM para que Excel reconozca los acentos)."""
+    yield '\ufeff'
+    for i, bloque in enumerate(bloques):
+        yield bloque.to_csv(index=False, header=i == 0)
+
+
+class _Salida(io.RawIOBase):
+    """Destino de escritura que guarda lo escrito hasta que se recoge con `vaciar`."""
+
+    def __init__(self):
+        self._partes = []
+        self._posicion = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def vaciar(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
+
+
+def _esquema_exportacion(tabla):
+    # Esquema del archivo a partir del primer bloque, válido para todos: el tipo de los códigos de una
+    # categórica depende de cuántas categorías tenga cada mes (int8, int16...) y una columna sin
+    # valores en el primer bloque no tiene tipo
+    campos = []
+    for campo in tabla.schema:
+        if pa.types.is_dictionary(campo.type):
+            campo = campo.with_type(pa.dictionary(pa.int32(), campo.type.value_type))
+        elif pa.types.is_null(campo.type):
+            campo = campo.with_type(pa.string())
+        campos.append(campo)
+    return pa.schema(campos, metadata=tabla.schema.metadata)
+
+
+def a_parquet(bloques):
+    """Archivo Parquet por bloques: cada bloque es un row group que se envía en cuanto se escribe."""
+    salida = _Salida()
+    escritor = None
+    for bloque in bloques:
+        tabla = pa.Table.from_pandas(bloque, preserve_index=False)
+        if escritor is None:
+            escritor = pq.ParquetWriter(salida, _esquema_exportacion(tabla))
+        # Cada bloque (de cualquier mes) se convierte al esquema del archivo
+        escritor.write_table(tabla.cast(escritor.schema))
+        yield salida.vaciar()
+    escritor.close()
+    yield salida.vaciar()
+
+
+def a_xlsx(bloques):
+    """Archivo xlsx escrito fila a fila (modo write_only de openpyxl) y enviado por trozos.
+
+    El zip de un xlsx solo se puede cerrar al final, así que se escribe en un archivo
+    temporal en disco en lugar de en memoria y después se envía.
+    """
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    for i, bloque in enumerate(bloques):
+        if i == 0:
+            hoja.append([str(columna) for columna in bloque.columns])
+        # Los vacíos (NaN, NaT) se dejan como celdas vacías
+        for fila in bloque.astype(object).where(bloque.notna(), None).itertuples(index=False, name=None):
+            hoja.append(fila)
+
+    with tempfile.TemporaryFile() as archivo:
+        libro.save(archivo)
+        archivo.seek(0)
+        while trozo := archivo.read(BYTES_POR_TROZO):
+            yield trozo
+
+
+# Formato -> (tipo MIME, función que convierte los bloques en el contenido del archivo)
+FORMATOS = {
+    'csv': ('text/csv', a_csv),
+    'parquet': ('application/vnd.apache.parquet', a_parquet),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', a_xlsx),
+}
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Archivo JSON con las reglas de homologación; se vuelve a leer en cuanto cambia, sin reiniciar
+HOMOLOGACION_ARCHIVO = os.getenv('HOMOLOGACION_ARCHIVO',
+                                 os.path.join(os.path.dirname(os.path.abspath(__file__)), 'homologacion.json'))
+
+# Estatus homologados posibles (categorías fijas de la columna 'Estatus Homologado')
+ESTATUS_HOMOLOGADOS = ['Aprobada', 'Rechazada', 'Revisar registro']
+
+
+class ReglasHomologacion:
+    """Reglas con las que se derivan al ingerir 'Estatus Homologado' y 'Numero de cuenta'.
+
+    - `estatus`: estado de operación -> estatus homologado; los estados que no aparecen
+      (o vacíos) reciben `estatus_por_defecto`.
+    - `cuenta_vacios`: valores de la cuenta en Claroscore que equivalen a no tenerla; las
+      cuentas vacías, sin pedido en Claroscore o no numéricas se sustituyen por `cuenta_por_defecto`.
+    """
+
+    def __init__(self, estatus, estatus_por_defecto='Revisar registro', cuenta_vacios=('undefined',),
+                 cuenta_por_defecto=0):
+        desconocidos = sorted({*estatus.values(), estatus_por_defecto} - set(ESTATUS_HOMOLOGADOS))
+        if desconocidos:
+            raise ValueError(f'Estatus homologados no válidos: {", ".join(map(str, desconocidos))} '
+                             f'(deben ser {", ".join(ESTATUS_HOMOLOGADOS)})')
+        self.estatus = dict(estatus)
+        self.estatus_por_defecto = estatus_por_defecto
+        self.cuenta_vacios = list(cuenta_vacios)
+        self.cuenta_por_defecto = int(cuenta_por_defecto)
+        # Código (posición en ESTATUS_HOMOLOGADOS) de cada estado y de los que no tienen regla
+        self._codigos = {estado: ESTATUS_HOMOLOGADOS.index(destino) for estado, destino in self.estatus.items()}
+        self._codigo_por_defecto = ESTATUS_HOMOLOGADOS.index(estatus_por_defecto)
+
+    @classmethod
+    def leer(cls, ruta):
+        with open(ruta, encoding='utf-8') as archivo:
+            datos = json.load(archivo)
+        return cls(datos['estatus'], datos.get('estatus_por_defecto', 'Revisar registro'),
+                   datos.get('cuenta_vacios', ('undefined',)), datos.get('cuenta_por_defecto', 0))
+
+    def guardar(self, ruta):
+        with open(ruta, 'w', encoding='utf-8') as archivo:
+            json.dump(self.como_dict(), archivo, ensure_ascii=False, indent=2)
+
+    def como_dict(self):
+        return {'estatus': self.estatus, 'estatus_por_defecto': self.estatus_por_defecto,
+                'cuenta_vacios': self.cuenta_vacios, 'cuenta_por_defecto': self.cuenta_por_defecto}
+
+    @property
+    def huella(self):
+        """Identifica el contenido de las reglas (forma parte de la ruta de los snapshots)."""
+        texto = json.dumps(self.como_dict(), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(texto.encode('utf-8')).hexdigest()[:16]
+
+    def estatus_de(self, estados):
+        """'Estatus Homologado' de cada estado, con una sola búsqueda por código de categoría.
+
+        Las reglas se aplican a las categorías distintas (unas pocas) y el resultado se
+        reparte a las filas indexando con sus códigos, sin recorrer los textos fila a fila.
+        """
+        if isinstance(estados.dtype, pd.CategoricalDtype):
+            codigos, categorias = estados.cat.codes.to_numpy(), estados.cat.categories
+        else:
+            codigos, categorias = pd.factorize(estados)
+        # Una entrada por categoría y una última para los vacíos (código -1)
+        tabla = np.array([self._codigos.get(estado, self._codigo_por_defecto) for estado in categorias]
+                         + [self._codigo_por_defecto], dtype=np.int8)
+        return pd.Categorical.from_codes(tabla[codigos], categories=ESTATUS_HOMOLOGADOS)
+
+    def cuentas(self, valores):
+        """'Numero de cuenta' como enteros (int64) a partir de los valores de Claroscore."""
+        valores = pd.Series(valores, copy=False)
+        if pd.api.types.is_numeric_dtype(valores):
+            return self._enteros(valores)
+        # Cada cuenta se repite en muchas filas: se convierten solo los valores distintos y el
+        # resultado se reparte con los códigos de factorize (-1, los vacíos, toma el último)
+        codigos, distintos = pd.factorize(valores)
+        distintos = pd.Series(distintos, dtype=object)
+        distintos = distintos.mask(distintos.isin(self.cuenta_vacios))
+        # Con tipos nulables los números grandes no pasan por float y no pierden precisión
+        numeros = pd.to_numeric(distintos, errors='coerce', dtype_backend='numpy_nullable')
+        invalidas = int((numeros.isna() & distintos.notna()).sum())
+        if invalidas:
+            logger.warning('%d cuentas distintas no numéricas se sustituyen por %d', invalidas, self.cuenta_por_defecto)
+        return np.append(self._enteros(numeros), self.cuenta_por_defecto)[codigos]
+
+    def _enteros(self, numeros):
+        numeros = numeros.fillna(self.cuenta_por_defecto)
+        if pd.api.types.is_float_dtype(numeros):
+            numeros = numeros.astype('float64')
+        return numeros.astype(np.int64).to_numpy()
+
+
+_vigentes = None  # (firma del archivo, reglas leídas de él)
+_lock = threading.Lock()
+
+
+def reglas_vigentes():
+    """Reglas de HOMOLOGACION_ARCHIVO, releídas si el archivo cambió desde la última consulta.
+
+    Si la versión nueva no es válida se registra el error y se siguen usando las anteriores.
+    """
+    global _vigentes
+    try:
+        estado = os.stat(HOMOLOGACION_ARCHIVO)
+        firma = (estado.st_mtime_ns, estado.st_size)
+    except OSError:
+        firma = None
+    with _lock:
+        if _vigentes is not None and _vigentes[0] == firma:
+            return _vigentes[1]
+        try:
+            reglas = ReglasHomologacion.leer(HOMOLOGACION_ARCHIVO)
+        except (OSError, ValueError, KeyError, TypeError):
+            if _vigentes is None:
+                raise
+            logger.exception('Reglas de homologación no válidas en %s: se mantienen las anteriores',
+                             HOMOLOGACION_ARCHIVO)
+            _vigentes = (firma, _vigentes[1])
+            return _vigentes[1]
+        if _vigentes is not None and reglas.huella != _vigentes[1].huella:
+            logger.info('Reglas de homologación recargadas desde %s', HOMOLOGACION_ARCHIVO)
+        _vigentes = (firma, reglas)
+        return reglas
@@ -0,0 +1,157 @@
+import bisect
+import collections
+import contextlib
+import contextvars
+import cProfile
+import datetime
+import os
+import threading
+import time
+
+# Límites (en segundos) de las cubetas de los histogramas de duración
+CUBETAS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Texto de ayuda de cada métrica en la salida de /metrics
+DESCRIPCIONES = {
+    'informe_etapa_segundos': 'Duración de cada etapa de la ingesta y del informe',
+    'informe_peticion_segundos': 'Duración total de las peticiones (incluido el envío de la respuesta)',
+    'informe_filas_total': 'Filas leídas o generadas por etapa',
+    'informe_bytes_total': 'Bytes descargados de los blobs',
+    'informe_cache_total': 'Consultas a las caches según si hubo acierto o fallo',
+    'informe_ingestas_total': 'Meses ingeridos completos o solo con las filas nuevas de T1',
+    'informe_respuestas_304_total': 'Peticiones respondidas con 304 porque el navegador ya tenía la página',
+}
+
+# Etapas medidas durante la petición en curso (para la cabecera Server-Timing)
+_etapas_peticion = contextvars.ContextVar('etapas_peticion', default=None)
+
+
+class Metricas:
+    """Contadores e histogramas en memoria del proceso, exportables en formato de texto de Prometheus.
+
+    Cada proceso (worker) lleva sus propias métricas; Prometheus las suma al consultarlos.
+    """
+
+    def __init__(self, cubetas=CUBETAS):
+        self.cubetas = cubetas
+        self._lock = threading.Lock()
+        self._contadores = collections.defaultdict(float)  # (nombre, etiquetas) -> valor
+        self._histogramas = {}  # (nombre, etiquetas) -> [conteo por cubeta, suma, total]
+
+    def contar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] += valor
+
+    def observar(self, nombre, segundos, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = [[0] * (len(self.cubetas) + 1), 0.0, 0]
+            histograma[0][bisect.bisect_left(self.cubetas, segundos)] += 1
+            histograma[1] += segundos
+            histograma[2] += 1
+
+    def texto(self):
+        """Todas las métricas en el formato de texto de Prometheus."""
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            histogramas = sorted((clave, (list(h[0]), h[1], h[2])) for clave, h in self._histogramas.items())
+
+        lineas = []
+        anterior = None
+        for (nombre, etiquetas), valor in contadores:
+            if nombre != anterior:
+                lineas += [f'# HELP {nombre} {DESCRIPCIONES.get(nombre, nombre)}', f'# TYPE {nombre} counter']
+                anterior = nombre
+            lineas.append(f'{nombre}{_etiquetas(etiquetas)} {valor:g}')
+        for (nombre, etiquetas), (conteos, suma, total) in histogramas:
+            if nombre != anterior:
+                lineas += [f'# HELP {nombre} {DESCRIPCIONES.get(nombre, nombre)}', f'# TYPE {nombre} histogram']
+                anterior = nombre
+            acumulado = 0
+            for limite, conteo in zip([*map(str, self.cubetas), '+Inf'], conteos):
+                acumulado += conteo
+                lineas.append(f'{nombre}_bucket{_etiquetas(etiquetas + (("le", limite),))} {acumulado}')
+            lineas.append(f'{nombre}_sum{_etiquetas(etiquetas)} {suma:g}')
+            lineas.append(f'{nombre}_count{_etiquetas(etiquetas)} {total}')
+        return '\n'.join(lineas) + '\n'
+
+
+def _etiquetas(etiquetas):
+    if not etiquetas:
+        return ''
+    valores = ','.join('{}="{}"'.format(clave, str(valor).replace('\\', '\\\\').replace('"', '\\"'))
+                       for clave, valor in etiquetas)
+    return '{' + valores + '}'
+
+
+metricas = Metricas()
+
+
+@contextlib.contextmanager
+def medir(etapa):
+    """Mide la duración de una etapa: la suma a su histograma y, si hay una petición en curso, a su Server-Timing."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        metricas.observar('informe_etapa_segundos', duracion, etapa=etapa)
+        etapas = _etapas_peticion.get()
+        if etapas is not None:
+            etapas[etapa] += duracion
+
+
+def contar(nombre, valor=1, **etiquetas):
+    metricas.contar(nombre, valor, **etiquetas)
+
+
+def registrar_cache(nombre, acierto):
+    """Registra una consulta a la cache `nombre`."""
+    metricas.contar('informe_cache_total', cache=nombre, resultado='acierto' if acierto else 'fallo')
+
+
+def iniciar_peticion():
+    """Empieza a acumular las etapas de la petición actual (las medidas en otros hilos no se incluyen)."""
+    _etapas_peticion.set(collections.defaultdict(float))
+
+
+def server_timing():
+    """Valor de la cabecera Server-Timing con las etapas medidas hasta ahora en la petición."""
+    etapas = _etapas_peticion.get() or {}
+    return ', '.join(f'{etapa};dur={segundos * 1000:.1f}' for etapa, segundos in etapas.items())
+
+
+class Perfilador:
+    """Perfila cada petición con cProfile y guarda en `carpeta` el perfil de las que tardan al menos `umbral` segundos.
+
+    Solo puede haber un perfil activo a la vez: las peticiones que llegan mientras se
+    perfila otra se atienden sin perfilar.
+    """
+
+    def __init__(self, carpeta, umbral):
+        self.carpeta = carpeta
+        self.umbral = umbral
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        if not self.carpeta or not self._lock.acquire(blocking=False):
+            return None
+        perfil = cProfile.Profile()
+        perfil.enable()
+        return perfil, time.perf_counter()
+
+    def terminar(self, estado, nombre):
+        """Detiene el perfil iniciado con `iniciar` y lo guarda como `.prof` si la petición fue lenta."""
+        if estado is None:
+            return
+        perfil, inicio = estado
+        perfil.disable()
+        self._lock.release()
+        duracion = time.perf_counter() - inicio
+        if duracion >= self.umbral:
+            os.makedirs(self.carpeta, exist_ok=True)
+            marca = datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            perfil.dump_stats(os.path.join(self.carpeta, f'{marca}_{nombre}_{duracion * 1000:.0f}ms.prof'))
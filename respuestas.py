@@ -0,0 +1,147 @@
+import collections
+import hashlib
+import os
+import threading
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:  # Brotli es opcional: sin el paquete solo se ofrece gzip
+    brotli = None
+
+# Páginas renderizadas que se conservan en memoria y durante cuánto tiempo
+RESPUESTAS_CACHE_MAX = int(os.getenv('RESPUESTAS_CACHE_MAX', '64'))
+RESPUESTAS_TTL_SEGUNDOS = float(os.getenv('RESPUESTAS_TTL_SEGUNDOS', '300'))
+# Tamaño máximo (ya comprimido) de una respuesta para guardarla; las mayores solo se envían
+RESPUESTA_BYTES_MAX = int(float(os.getenv('RESPUESTA_MB_MAX', '8')) * 1024 * 1024)
+
+# Nivel de compresión (gzip 1-9, brotli 0-11)
+GZIP_NIVEL = int(os.getenv('GZIP_NIVEL', '6'))
+BROTLI_CALIDAD = int(os.getenv('BROTLI_CALIDAD', '5'))
+
+CODIFICACIONES = ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def elegir_codificacion(accept_encodings):
+    """Codificación a usar según la cabecera Accept-Encoding ('identity' si no se admite ninguna)."""
+    return accept_encodings.best_match(CODIFICACIONES, default='identity')
+
+
+def huella(*partes):
+    """ETag fuerte a partir de la versión del dataset, los filtros normalizados y la codificación."""
+    return hashlib.sha1(repr(partes).encode('utf-8')).hexdigest()
+
+
+class HuellaArchivos:
+    """Huella del contenido de los archivos que generan las respuestas (plantillas, código).
+
+    Forma parte de los ETag para que, al desplegar otra versión, ni los navegadores ni la cache
+    de respuestas sigan usando páginas generadas con la anterior. El contenido solo se vuelve a
+    leer si cambia la fecha o el tamaño de algún archivo (p. ej. plantillas recargadas en desarrollo).
+    """
+
+    def __init__(self, rutas, version=''):
+        self.rutas = list(rutas)
+        self.version = version
+        self._vigente = None  # (firma de los archivos, huella)
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        firma = []
+        for ruta in self.rutas:
+            try:
+                estado = os.stat(ruta)
+                firma.append((estado.st_mtime_ns, estado.st_size))
+            except OSError:
+                firma.append(None)
+        with self._lock:
+            if self._vigente is None or self._vigente[0] != firma:
+                resumen = hashlib.sha1(self.version.encode('utf-8'))
+                for ruta in self.rutas:
+                    try:
+                        with open(ruta, 'rb') as archivo:
+                            resumen.update(archivo.read())
+                    except OSError:
+                        resumen.update(b'-')
+                self._vigente = (firma, resumen.hexdigest()[:16])
+            return self._vigente[1]
+
+
+def codificar(fragmentos, codificacion):
+    """Convierte los fragmentos de texto en bytes comprimidos con `codificacion`.
+
+    Tras cada fragmento se vacía el compresor para que el navegador pueda ir pintando
+    la página mientras se sigue enviando.
+    """
+    if codificacion == 'gzip':
+        compresor = zlib.compressobj(GZIP_NIVEL, zlib.DEFLATED, 31)  # 31 = formato gzip
+        comprimir, vaciar, terminar = compresor.compress, lambda: compresor.flush(zlib.Z_SYNC_FLUSH), compresor.flush
+    elif codificacion == 'br':
+        compresor = brotli.Compressor(quality=BROTLI_CALIDAD)
+        comprimir, vaciar, terminar = compresor.process, compresor.flush, compresor.finish
+    else:
+        for fragmento in fragmentos:
+            yield fragmento.encode('utf-8')
+        return
+
+    for fragmento in fragmentos:
+        bloque = comprimir(fragmento.encode('utf-8')) + vaciar()
+        if bloque:
+            yield bloque
+    yield terminar()
+
+
+class CacheRespuestas:
+    """Cache LRU con caducidad de páginas ya renderizadas (y comprimidas), indexada por su ETag."""
+
+    def __init__(self, max_entradas=RESPUESTAS_CACHE_MAX, ttl=RESPUESTAS_TTL_SEGUNDOS):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas = collections.OrderedDict()  # etag -> (instante, cuerpo)
+        self._lock = threading.Lock()
+
+    def obtener(self, etag):
+        with self._lock:
+            entrada = self._entradas.get(etag)
+            if entrada is None:
+                return None
+            if time.monotonic() - entrada[0] > self.ttl:
+                del self._entradas[etag]
+                return None
+            self._entradas.move_to_end(etag)
+            return entrada[1]
+
+    def guardar(self, etag, cuerpo):
+        if self.max_entradas <= 0:
+            return
+        with self._lock:
+            self._entradas[etag] = (time.monotonic(), cuerpo)
+            self._entradas.move_to_end(etag)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def guardar_al_terminar(self, etag, bloques):
+        """Deja pasar los bloques de la respuesta y, si se envía completa, guarda el cuerpo.
+
+        Si el cuerpo supera RESPUESTA_BYTES_MAX se deja de acumular y no se guarda.
+        """
+        partes, tamano = [], 0
+        for bloque in bloques:
+            if partes is not None:
+                tamano += len(bloque)
+                if tamano <= RESPUESTA_BYTES_MAX:
+                    partes.append(bloque)
+                else:
+                    partes = None
+            yield bloque
+        # Si el cliente corta la conexión el generador se cierra antes y no se guarda nada
+        if partes is not None:
+            self.guardar(etag, b''.join(partes))
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+
+
+cache_respuestas = CacheRespuestas()
@@ -0,0 +1,23 @@
+"""Exportación por bloques: el archivo debe poder escribirse aunque los bloques vengan de meses distintos."""
+import io
+
+import pandas as pd
+
+import exportar
+
+
+def test_parquet_con_bloques_de_tipos_distintos():
+    # Primer bloque: pocas categorías (códigos int8) y 'Pedido' sin valores; el segundo, de otro
+    # mes, con más de 127 correos (códigos int16) y 'Pedido' con texto
+    bloques = [
+        pd.DataFrame({'Email Cliente': pd.Categorical(['a@correo.com', 'b@correo.com']),
+                      'Pedido': [None, None], 'Monto': [1.0, 2.0]}),
+        pd.DataFrame({'Email Cliente': pd.Categorical([f'cliente{i}@correo.com' for i in range(300)]),
+                      'Pedido': [str(i) for i in range(300)], 'Monto': [3.0] * 300}),
+    ]
+
+    resultado = pd.read_parquet(io.BytesIO(b''.join(exportar.a_parquet(iter(bloques)))))
+    assert len(resultado) == 302
+    assert resultado['Email Cliente'].iloc[-1] == 'cliente299@correo.com'
+    assert resultado['Pedido'].iloc[-1] == '299'
+    assert resultado['Monto'].sum() == 903.0
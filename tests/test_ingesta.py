@@ -0,0 +1,193 @@
+"""La ingesta por bloques y la incremental deben dar lo mismo que procesar el mes completo."""
+import io
+import os
+import re
+import zipfile
+
+import openpyxl
+import pandas as pd
+import pytest
+
+import datos
+from benchmarks.generar_datos import generar_mes
+from contenedor_local import ContenedorLocal
+
+MES = '092026'
+FILAS = 3000
+FILAS_PREVIAS = 2000
+
+
+@pytest.fixture
+def carpeta(tmp_path, monkeypatch):
+    """Contenedor local con un mes sintético y snapshots en una carpeta temporal."""
+    monkeypatch.setattr(datos, 'SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+    monkeypatch.setattr(datos, 'INGESTA_PROCESOS', 0)
+    # Bloques pequeños para que el mes se reparta en varios
+    monkeypatch.setattr(datos, 'INGESTA_BLOQUES_FILAS', 700)
+    generar_mes(str(tmp_path / 'blobs'), MES, FILAS, correos=300, cuentas=100, columnas_extra=1)
+    return tmp_path / 'blobs'
+
+
+@pytest.fixture
+def por_bloques(request, monkeypatch):
+    # Con un umbral mínimo cualquier T1 se procesa por bloques
+    monkeypatch.setattr(datos, 'INGESTA_BLOQUES_UMBRAL_MB', 1e-6 if request.param else 0)
+    return request.param
+
+
+@pytest.fixture
+def incrementales(monkeypatch):
+    """Registra el resultado de cada intento de ingesta incremental ('incremental' o 'completa')."""
+    resultados = []
+    original = datos.incrementar_snapshot
+
+    def espia(*args):
+        try:
+            filas = original(*args)
+        except datos._ReingestaCompleta:
+            resultados.append('completa')
+            raise
+        resultados.append('incremental')
+        return filas
+
+    monkeypatch.setattr(datos, 'incrementar_snapshot', espia)
+    return resultados
+
+
+def _filas_T1(ruta):
+    libro = openpyxl.load_workbook(ruta, read_only=True)
+    filas = [list(fila) for fila in libro.active.iter_rows(values_only=True)]
+    libro.close()
+    return filas
+
+
+def _escribir_T1(ruta, filas):
+    # Se reescribe el archivo y se adelanta su fecha para que su versión (ETag) cambie siempre
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet()
+    for fila in filas:
+        hoja.append(fila)
+    libro.save(ruta)
+    estado = os.stat(ruta)
+    os.utime(ruta, ns=(estado.st_atime_ns, estado.st_mtime_ns + 10 ** 9))
+
+
+def _ingerir(carpeta):
+    contenedor = ContenedorLocal(str(carpeta))
+    version = datos.versiones_blobs(contenedor, datos.nombres_blobs(MES))
+    _, merged, cubo, _ = datos.ingerir_mes(contenedor, MES, version)
+    return merged, cubo
+
+
+def _referencia(carpeta):
+    # `procesar_mes` sobre los archivos actuales, sin snapshots ni bloques
+    T1, claroscore = ((carpeta / nombre).read_bytes() for nombre in datos.nombres_blobs(MES))
+    merged = datos.procesar_mes(T1, claroscore)
+    return merged, datos.construir_cubo(merged)
+
+
+def _normalizar(df):
+    # Mismo contenido sin depender del orden de las filas ni del de las categorías (la ingesta por
+    # bloques las añade según aparecen); las sumas de montos pueden variar en el último decimal
+    df = df[sorted(df.columns)].copy()
+    for columna in df.columns:
+        if columna == 'Suma_Monto':
+            df[columna] = df[columna].round(6)
+        df[columna] = df[columna].astype(object).where(df[columna].notna(), None).astype(str)
+    return df.sort_values(list(df.columns), ignore_index=True)
+
+
+def _comprobar_iguales(obtenido, esperado):
+    merged, cubo = obtenido
+    merged_esperado, cubo_esperado = esperado
+    assert len(merged) == len(merged_esperado)
+    assert _normalizar(merged).equals(_normalizar(merged_esperado))
+    assert cubo.keys() == cubo_esperado.keys()
+    for nombre in cubo_esperado:
+        assert _normalizar(cubo[nombre]).equals(_normalizar(cubo_esperado[nombre])), nombre
+
+
+def test_por_bloques_igual_que_completo(carpeta, monkeypatch):
+    monkeypatch.setattr(datos, 'INGESTA_BLOQUES_UMBRAL_MB', 1e-6)
+    _comprobar_iguales(_ingerir(carpeta), _referencia(carpeta))
+
+
+def _tipos(df):
+    return {columna: 'category' if isinstance(tipo, pd.CategoricalDtype) else str(tipo)
+            for columna, tipo in df.dtypes.items()}
+
+
+def test_mismos_tipos_por_bloques_y_completo(carpeta, monkeypatch):
+    merged_completo, _ = _ingerir(carpeta)
+    monkeypatch.setattr(datos, 'SNAPSHOT_DIR', str(carpeta.parent / 'snapshots_bloques'))
+    monkeypatch.setattr(datos, 'INGESTA_BLOQUES_UMBRAL_MB', 1e-6)
+    merged_bloques, _ = _ingerir(carpeta)
+    assert _tipos(merged_bloques) == _tipos(merged_completo)
+    # También al volver a leerlos del snapshot
+    assert _tipos(_ingerir(carpeta)[0]) == _tipos(merged_completo)
+
+
+@pytest.mark.parametrize('por_bloques', [False, True], indirect=True)
+def test_incremental_igual_que_completo(carpeta, por_bloques, incrementales):
+    ruta = carpeta / f'T1_{MES}.xlsx'
+    filas = _filas_T1(ruta)
+    _escribir_T1(ruta, filas[:FILAS_PREVIAS + 1])
+    _ingerir(carpeta)
+
+    _escribir_T1(ruta, filas)
+    obtenido = _ingerir(carpeta)
+    assert incrementales == ['incremental']
+    _comprobar_iguales(obtenido, _referencia(carpeta))
+
+
+@pytest.mark.parametrize('por_bloques', [False, True], indirect=True)
+def test_fila_anterior_modificada_reingesta_completa(carpeta, por_bloques, incrementales):
+    ruta = carpeta / f'T1_{MES}.xlsx'
+    filas = _filas_T1(ruta)
+    _escribir_T1(ruta, filas[:FILAS_PREVIAS + 1])
+    _ingerir(carpeta)
+
+    # Se añaden filas, pero también cambia el monto de una ya procesada
+    columna_monto = filas[0].index('Monto')
+    filas[10][columna_monto] = round(filas[10][columna_monto] + 1, 2)
+    _escribir_T1(ruta, filas)
+    obtenido = _ingerir(carpeta)
+    assert incrementales == ['completa']
+    _comprobar_iguales(obtenido, _referencia(carpeta))
+
+
+@pytest.mark.parametrize('por_bloques', [False, True], indirect=True)
+def test_terminacion_con_texto(carpeta, por_bloques):
+    # Una terminación escrita como texto entre las numéricas (con el cero inicial)
+    ruta = carpeta / f'T1_{MES}.xlsx'
+    filas = _filas_T1(ruta)
+    filas[5][filas[0].index('TerminaciÃ³n de la Tarjeta')] = '0123'
+    _escribir_T1(ruta, filas)
+
+    merged, _ = _ingerir(carpeta)
+    terminaciones = set(merged['Terminacion de la Tarjeta'].dropna())
+    assert '0123' in terminaciones and all(isinstance(valor, str) for valor in terminaciones)
+
+
+def test_snapshot_no_guardado_se_sirve_en_memoria(carpeta, monkeypatch):
+    def fallar(*args, **kwargs):
+        raise datos.pa.ArrowInvalid('no se pudo convertir')
+
+    monkeypatch.setattr(datos, 'guardar_snapshot', fallar)
+    merged, cubo = _ingerir(carpeta)
+    _comprobar_iguales((merged, cubo), _referencia(carpeta))
+
+
+def test_dimension_de_hoja_incorrecta(tmp_path):
+    # Algunos programas escriben una dimensión (<dimension ref=...>) que no abarca los datos; el
+    # archivo generado no la trae y se añade una que solo cubre la primera celda
+    ruta_T1, _ = generar_mes(str(tmp_path), MES, 50, columnas_extra=0)
+    salida = io.BytesIO()
+    with zipfile.ZipFile(ruta_T1) as origen, zipfile.ZipFile(salida, 'w') as destino:
+        for nombre in origen.namelist():
+            contenido = origen.read(nombre)
+            if nombre.startswith('xl/worksheets/'):
+                contenido = re.sub(rb'(<dimension [^>]*>)?<sheetData>', b'<dimension ref="A1"/><sheetData>', contenido)
+            destino.writestr(nombre, contenido)
+
+    assert len(datos.leer_xlsx(salida.getvalue(), datos.COLUMNAS_T1)) == 50
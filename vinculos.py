@@ -0,0 +1,240 @@
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from agregados import ESTATUS
+
+# Modo aproximado (HyperLogLog) para rangos muy amplios: si la selección tiene más de este número de
+# aristas los correos distintos se estiman en lugar de contarse exactamente (0 = siempre exacto)
+VINCULOS_HLL_ARISTAS = int(os.getenv('VINCULOS_HLL_ARISTAS', '0'))
+# Bits del índice de registro de HyperLogLog: 2**bits registros por grupo (error típico 1.04 / sqrt(2**bits))
+VINCULOS_HLL_BITS = int(os.getenv('VINCULOS_HLL_BITS', '6'))
+
+# Día de las aristas sin fecha: quedan al final y ningún rango de fechas las incluye
+SIN_FECHA = np.iinfo(np.int32).max
+
+
+class IndiceVinculos:
+    """Índice bipartito cuenta <-> correo con códigos enteros, construido al ingerir a partir del cubo.
+
+    - `cuentas` / `correos` / `estados`: valores de cada código (cuentas y correos ordenados).
+    - Pares: cada par distinto cuenta/correo, ordenados por cuenta y correo (`par_cuenta`,
+      `par_correo`; correo -1 si está vacío). Es una lista de adyacencia tipo CSR: los
+      correos de la cuenta `c` son los pares `inicio_cuenta[c]:inicio_cuenta[c + 1]`.
+    - Aristas: las filas del cubo 'cuenta_email' (día, estado, estatus y par), ordenadas por
+      día, así un rango de fechas es un corte contiguo; `orden_par` las agrupa por par.
+
+    Con él los correos distintos por cuenta, las cuentas con muchos correos (y al revés) y
+    el detalle de una cuenta se resuelven con operaciones sobre arrays, sin recorrer `merged`.
+    """
+
+    ARCHIVOS = ('aristas', 'pares', 'cuentas', 'correos', 'estados')
+
+    def __init__(self, cuentas, correos, estados, dia, estado, estatus, par, orden_par, par_cuenta, par_correo):
+        self.cuentas = cuentas
+        self.correos = correos
+        self.estados = estados
+        self.dia = dia
+        self.estado = estado
+        self.estatus = estatus
+        self.par = par
+        self.orden_par = orden_par
+        self.par_cuenta = par_cuenta
+        self.par_correo = par_correo
+
+    @classmethod
+    def desde_cubo(cls, cuenta_email):
+        """Construye el índice a partir de la tabla 'cuenta_email' del cubo (pares distintos de cada día)."""
+        fechas = cuenta_email['Fecha'].to_numpy()
+        dia = np.where(np.isnat(fechas), SIN_FECHA, fechas.astype('datetime64[D]').astype(np.int64)).astype(np.int32)
+        # Orden estable: dentro de cada día se conserva el orden del cubo (el de aparición en `merged`)
+        orden = np.argsort(dia, kind='stable')
+
+        codigo_cuenta, cuentas = pd.factorize(cuenta_email['Numero de cuenta'], sort=True, use_na_sentinel=False)
+        codigo_correo, correos = pd.factorize(cuenta_email['Email Cliente'], sort=True)
+        codigo_estado, estados = pd.factorize(cuenta_email['Estado de Operacion'])
+        # Solo los estatus que se cuentan (Aprobada, Rechazada); el resto queda en -1
+        estatus = pd.Index(ESTATUS).get_indexer(cuenta_email['Estatus Homologado'])
+
+        # Un código por par cuenta/correo, en orden de cuenta y correo (los correos vacíos primero)
+        base = len(correos) + 1
+        codigo_par, claves = pd.factorize(codigo_cuenta.astype(np.int64) * base + codigo_correo + 1, sort=True)
+        par = codigo_par.astype(np.int32)[orden]
+        return cls(
+            cuentas=np.asarray(cuentas), correos=np.asarray(correos, dtype=object),
+            estados=np.asarray(estados, dtype=object),
+            dia=dia[orden], estado=codigo_estado.astype(np.int16)[orden], estatus=estatus.astype(np.int8)[orden],
+            par=par, orden_par=np.argsort(par, kind='stable').astype(np.int32),
+            par_cuenta=(claves // base).astype(np.int32), par_correo=(claves % base - 1).astype(np.int32),
+        )
+
+    def guardar(self, carpeta):
+        """Escribe el índice como archivos Arrow IPC en `carpeta`."""
+        os.makedirs(carpeta, exist_ok=True)
+        tablas = {
+            'aristas': {'dia': self.dia, 'estado': self.estado, 'estatus': self.estatus, 'par': self.par,
+                        'orden_par': self.orden_par},
+            'pares': {'cuenta': self.par_cuenta, 'correo': self.par_correo},
+            'cuentas': {'valor': self.cuentas},
+            'correos': {'valor': self.correos},
+            'estados': {'valor': self.estados},
+        }
+        for nombre, columnas in tablas.items():
+            tabla = pa.table(columnas)
+            with pa.OSFile(os.path.join(carpeta, f'{nombre}.arrow'), 'wb') as archivo:
+                with pa.ipc.new_file(archivo, tabla.schema) as escritor:
+                    escritor.write_table(tabla)
+
+    @classmethod
+    def leer(cls, carpeta):
+        """Abre un índice escrito con `guardar`; los arrays numéricos quedan mapeados en memoria."""
+        tablas = {}
+        for nombre in cls.ARCHIVOS:
+            tabla = pa.ipc.open_file(pa.memory_map(os.path.join(carpeta, f'{nombre}.arrow'), 'r')).read_all()
+            tablas[nombre] = {columna: tabla.column(columna).to_numpy() for columna in tabla.column_names}
+        aristas, pares = tablas['aristas'], tablas['pares']
+        return cls(
+            cuentas=tablas['cuentas']['valor'], correos=tablas['correos']['valor'].astype(object),
+            estados=tablas['estados']['valor'].astype(object),
+            dia=aristas['dia'], estado=aristas['estado'], estatus=aristas['estatus'], par=aristas['par'],
+            orden_par=aristas['orden_par'], par_cuenta=pares['cuenta'], par_correo=pares['correo'],
+        )
+
+    @property
+    def bytes(self):
+        return sum(array.nbytes for array in (self.dia, self.estado, self.estatus, self.par, self.orden_par,
+                                              self.par_cuenta, self.par_correo, self.cuentas))
+
+    @functools.cached_property
+    def inicio_cuenta(self):
+        # Punteros CSR cuenta -> pares (los pares están ordenados por cuenta)
+        return np.searchsorted(self.par_cuenta, np.arange(len(self.cuentas) + 1))
+
+    @functools.cached_property
+    def inicio_par(self):
+        # Punteros par -> aristas dentro de `orden_par`
+        return np.concatenate(([0], np.cumsum(np.bincount(self.par, minlength=len(self.par_cuenta)))))
+
+    @functools.cached_property
+    def _hll(self):
+        # Registro y rango de HyperLogLog de cada correo, a partir de un hash de 64 bits
+        bits = VINCULOS_HLL_BITS
+        hashes = pd.util.hash_array(self.correos)
+        registro = (hashes >> np.uint64(64 - bits)).astype(np.int64)
+        # Rango: posición del primer 1 en los 32 bits siguientes (frexp da el exponente exacto)
+        siguientes = ((hashes << np.uint64(bits)) >> np.uint64(32)).astype(np.float64)
+        rango = (33 - np.frexp(siguientes)[1]).astype(np.uint8)
+        return registro, rango
+
+    def _seleccion(self, fecha_inicio, fecha_final, estados_seleccionados):
+        """Par y estatus de las aristas que cumplen los filtros, con los mismos criterios que `datos.filtrar`."""
+        inicio, fin = 0, len(self.dia)
+        if fecha_inicio and fecha_final:
+            inicio = int(np.searchsorted(self.dia, _dia(fecha_inicio), side='left'))
+            fin = max(int(np.searchsorted(self.dia, _dia(fecha_final), side='right')), inicio)
+        par, estatus = self.par[inicio:fin], self.estatus[inicio:fin]
+        if estados_seleccionados:
+            mascara = self._mascara_estados(estados_seleccionados)[self.estado[inicio:fin]]
+            par, estatus = par[mascara], estatus[mascara]
+        return par, estatus
+
+    def _mascara_estados(self, estados_seleccionados):
+        # Tabla de códigos seleccionados; la última posición es el código -1 (estado vacío)
+        codigos = pd.Index(self.estados).get_indexer(estados_seleccionados)
+        seleccion = np.zeros(len(self.estados) + 1, dtype=bool)
+        seleccion[codigos[codigos >= 0]] = True
+        return seleccion
+
+    def correos_distintos(self, fecha_inicio, fecha_final, estados_seleccionados):
+        """Correos distintos por cuenta y estatus en las filas que cumplen los filtros.
+
+        Devuelve `(cuentas, conteos, aproximado)`: las cuentas presentes en la selección (en
+        orden), un array (cuentas x [Aprobada, Rechazada]) y si se estimó con HyperLogLog.
+        """
+        par, estatus = self._seleccion(fecha_inicio, fecha_final, estados_seleccionados)
+        presentes = np.zeros(len(self.cuentas), dtype=bool)
+        presentes[self.par_cuenta[par]] = True
+        cuentas = np.flatnonzero(presentes)
+
+        validas = (estatus >= 0) & (self.par_correo[par] >= 0)
+        par, estatus = par[validas], estatus[validas]
+        aproximado = 0 < VINCULOS_HLL_ARISTAS < len(par)
+        if aproximado:
+            conteos = self._estimar(cuentas, presentes, par, estatus)
+        else:
+            # Exacto sin ordenar: se marca cada (par, estatus) visto y se cuentan las marcas por cuenta
+            marcas = np.zeros(len(self.par_cuenta) * 2, dtype=bool)
+            marcas[par.astype(np.int64) * 2 + estatus] = True
+            distintos = np.flatnonzero(marcas)
+            grupos = self.par_cuenta[distintos >> 1].astype(np.int64) * 2 + (distintos & 1)
+            conteos = np.bincount(grupos, minlength=len(self.cuentas) * 2).reshape(-1, 2)[cuentas]
+        return self.cuentas[cuentas], conteos, aproximado
+
+    def _estimar(self, cuentas, presentes, par, estatus):
+        # HyperLogLog: un juego de registros por (cuenta presente, estatus); las aristas repetidas
+        # en varios días no hacen falta deduplicarlas porque cada registro guarda un máximo
+        registros_por_grupo = 2 ** VINCULOS_HLL_BITS
+        registro, rango = self._hll
+        posicion = np.cumsum(presentes) - 1
+        grupos = posicion[self.par_cuenta[par]] * 2 + estatus
+        correos = self.par_correo[par]
+        registros = np.zeros(len(cuentas) * 2 * registros_por_grupo, dtype=np.uint8)
+        np.maximum.at(registros, grupos * registros_por_grupo + registro[correos], rango[correos])
+        return _estimacion_hll(registros.reshape(-1, registros_por_grupo)).reshape(-1, 2)
+
+    def vinculados(self, lado, minimo, fecha_inicio=None, fecha_final=None, estados_seleccionados=None):
+        """Cuentas vinculadas a más de `minimo` correos distintos (`lado='cuentas'`) o correos vinculados
+        a más de `minimo` cuentas (`lado='correos'`) en las filas que cumplen los filtros.
+
+        Devuelve `(valores, conteos)` ordenados de mayor a menor número de vínculos.
+        """
+        if (fecha_inicio and fecha_final) or estados_seleccionados:
+            par, _ = self._seleccion(fecha_inicio, fecha_final, estados_seleccionados)
+            marcas = np.zeros(len(self.par_cuenta), dtype=bool)
+            marcas[par] = True
+            pares = np.flatnonzero(marcas)
+        else:
+            pares = np.arange(len(self.par_cuenta))
+        pares = pares[self.par_correo[pares] >= 0]
+
+        codigos, valores = (self.par_cuenta, self.cuentas) if lado == 'cuentas' else (self.par_correo, self.correos)
+        conteos = np.bincount(codigos[pares], minlength=len(valores))
+        seleccion = np.flatnonzero(conteos > minimo)
+        # Más vínculos primero; a igual número, por valor (los códigos están ordenados)
+        seleccion = seleccion[np.lexsort((seleccion, -conteos[seleccion]))]
+        return valores[seleccion], conteos[seleccion]
+
+    def correos_de_cuenta(self, numero, fecha_inicio=None, fecha_final=None, estados_seleccionados=None):
+        """Correos (sin repetir, vacío como None) de una cuenta en las filas que cumplen los filtros,
+        en orden de aparición por fecha."""
+        codigo = int(np.searchsorted(self.cuentas, numero))
+        if codigo == len(self.cuentas) or self.cuentas[codigo] != numero:
+            return []
+        desde, hasta = self.inicio_cuenta[codigo], self.inicio_cuenta[codigo + 1]
+        # Aristas de todos los pares de la cuenta; su posición es el orden por fecha
+        aristas = np.sort(self.orden_par[self.inicio_par[desde]:self.inicio_par[hasta]])
+        if fecha_inicio and fecha_final:
+            dias = self.dia[aristas]
+            aristas = aristas[(dias >= _dia(fecha_inicio)) & (dias <= _dia(fecha_final))]
+        if estados_seleccionados:
+            aristas = aristas[self._mascara_estados(estados_seleccionados)[self.estado[aristas]]]
+        correos = pd.unique(self.par_correo[self.par[aristas]])
+        return [self.correos[correo] if correo >= 0 else None for correo in correos.tolist()]
+
+
+def _dia(fecha):
+    return np.datetime64(fecha, 'D').astype(np.int64)
+
+
+def _estimacion_hll(registros):
+    """Cardinalidad estimada de cada fila de registros de HyperLogLog (con la corrección para pocos elementos)."""
+    m = registros.shape[1]
+    alfa = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    estimacion = alfa * m * m / np.exp2(-registros.astype(np.float64)).sum(axis=1)
+    # Conteo lineal cuando la estimación es pequeña y quedan registros vacíos (casi exacto)
+    vacios = (registros == 0).sum(axis=1)
+    lineal = m * np.log(m / np.maximum(vacios, 1))
+    return np.rint(np.where((estimacion <= 2.5 * m) & (vacios > 0), lineal, estimacion)).astype(np.int64)